@@ -0,0 +1,410 @@
+import re
+import time
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from ResultCache import normalize_sql
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+# NULL в столбцах int64 — минимальное значение, в кодах creator_id — -1.
+# Такие строки не проходят ни одно сравнение и не входят в SUM и COUNT(DISTINCT)
+NULL = -(1 << 63)
+NULL_CREATOR = -1
+
+# Какие столбцы держим в памяти: только то, что нужно агрегатам по видео
+# и приращениям снапшотов (~56 байт на снапшот). Первый столбец каждой
+# таблицы — ключ строки, второй — время, по которому строки отсортированы
+TABLES = {
+    'videos': {
+        'key': 'id',
+        'sort': 'video_created_at',
+        'columns': ('creator_id', 'video_created_at', 'views_count', 'likes_count', 'comments_count', 'reports_count'),
+    },
+    'video_snapshots': {
+        'key': 'id',
+        'sort': 'created_at',
+        'columns': (
+            'video_id', 'created_at',
+            'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+        ),
+    },
+}
+
+_TIMESTAMPS = {'video_created_at', 'created_at'}
+_UUIDS = {('videos', 'id'), ('video_snapshots', 'video_id')}
+_TZ_SUFFIX_RE = re.compile(r'([+-]\d{2})$')
+
+_SELECT_RE = re.compile(
+    r"select (?:count\(\*\)|count\(distinct (?P<distinct>\w+)\)|sum\((?P<sum>\w+)\)|coalesce\(sum\((?P<coalesce>\w+)\), ?0\))"
+    r" from (?P<table>\w+)(?: where (?P<where>.+))?"
+)
+_CONDITION_RE = re.compile(
+    r"(?:date\((?P<date>\w+)\)|(?P<column>\w+)) ?(?P<op>>=|<=|=|>|<) ?(?P<value>:\w+|-?\d+|'[^']*')"
+)
+
+
+def to_micros(value: datetime) -> int:
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _zone(name: str):
+    try:
+        return ZoneInfo(name)
+    except (ValueError, KeyError):
+        logger.warning(f"Зона сессии {name} не распознана: время без зоны реплика не обрабатывает")
+        return None
+
+
+def _select_expression(table: str, column: str) -> str:
+    # Столбцы приводятся к int64 на стороне PostgreSQL, чтобы массивы
+    # собирались из пачки строк целиком, без цикла по строкам в Python:
+    # UUID — младшие 64 бита, строковый ключ — hashtextextended, время —
+    # микросекунды от эпохи
+    if column == 'creator_id':
+        return column
+    if (table, column) in _UUIDS:
+        expression = f"('x' || right(replace({column}::text, '-', ''), 16))::bit(64)::bigint"
+    elif column == TABLES[table]['key']:
+        expression = f"hashtextextended({column}, 0)"
+    elif column in _TIMESTAMPS or column == 'updated_at':
+        expression = f"(extract(epoch FROM {column}) * 1000000)::bigint"
+    else:
+        expression = column
+    return f"coalesce({expression}, :null)"
+
+
+class ColumnarReplica:
+    # Копия videos и video_snapshots в столбцах NumPy: частые агрегаты
+    # (COUNT/SUM с фильтрами по дате и креатору) считаются векторно в
+    # памяти процесса, все остальное уходит в PostgreSQL
+    def __init__(self, batch_rows: int = 100000):
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise RuntimeError("Для COLUMNAR_REPLICA нужен пакет numpy: pip install numpy") from e
+
+        self.np = np
+        self.batch_rows = batch_rows
+        self.version = None
+        self.timezone = None
+        self.answered = 0
+        self.fallbacks = 0
+        self.rebuilds = 0
+        self.refreshes = 0
+        self.creators = {}
+        self._tables = {}
+        self._orders = {}
+        self._marks = {}
+        self._oids = None
+        self._partitions = set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._tables)
+
+    def _empty(self, table: str) -> dict:
+        np = self.np
+        spec = TABLES[table]
+        arrays = {'key': np.empty(0, dtype=np.int64)}
+        for column in spec['columns']:
+            arrays[column] = np.empty(0, dtype=np.int32 if column == 'creator_id' else np.int64)
+        return arrays
+
+    def _encode_creators(self, values, creators: dict):
+        # Словарь пополняется по уникальным значениям пачки, а не по строкам
+        np = self.np
+        values = np.array(values, dtype=object)
+        codes = np.full(len(values), NULL_CREATOR, dtype=np.int32)
+        present = values != None  # noqa: E711 — поэлементное сравнение NumPy
+        if present.any():
+            uniques, inverse = np.unique(values[present].astype(str), return_inverse=True)
+            lookup = np.array(
+                [creators.setdefault(value, len(creators)) for value in uniques.tolist()], dtype=np.int32
+            )
+            codes[present] = lookup[inverse]
+        return codes
+
+    async def _fetch(self, session: AsyncSession, table: str, since: Optional[int], creators: dict) -> tuple:
+        np = self.np
+        spec = TABLES[table]
+        names = ('key', 'updated_at') + spec['columns']
+        expressions = [_select_expression(table, spec['key'] if name == 'key' else name) for name in names]
+        query = f"SELECT {', '.join(expressions)} FROM {table}"
+        params = {"null": NULL}
+        if since is not None:
+            query += " WHERE updated_at > :since"
+            params["since"] = _EPOCH + since * _MICROSECOND
+
+        parts = {name: [] for name in names}
+        result = await session.stream(text(query), params)
+        async for rows in result.partitions(self.batch_rows):
+            for name, values in zip(names, zip(*rows)):
+                if name == 'creator_id':
+                    parts[name].append(self._encode_creators(values, creators))
+                else:
+                    parts[name].append(np.array(values, dtype=np.int64))
+
+        marks = parts.pop('updated_at')
+        mark = max((int(chunk.max()) for chunk in marks if len(chunk)), default=NULL)
+        if since is not None:
+            mark = max(mark, since)
+
+        empty = self._empty(table)
+        batch = {name: np.concatenate(chunks) if chunks else empty[name] for name, chunks in parts.items()}
+        return batch, None if mark == NULL else mark
+
+    def _merge(self, table: str, arrays: Optional[dict], order, batch: dict) -> tuple:
+        # Измененные строки удаляются, а пачка (новые и измененные строки)
+        # сортируется отдельно и вливается в уже отсортированные столбцы
+        # через searchsorted + insert: O(n + k log k) вместо сортировки
+        # всей таблицы. Возвращает новые массивы, старые не меняются: пока
+        # идет обновление, запросы читают прежнюю копию
+        np = self.np
+        sort_column = TABLES[table]['sort']
+        if arrays is None:
+            arrays, order = self._empty(table), np.empty(0, dtype=np.intp)
+
+        if len(arrays['key']) and len(batch['key']):
+            pos = np.searchsorted(arrays['key'], batch['key'], sorter=order)
+            rows = order[np.minimum(pos, len(order) - 1)]
+            found = arrays['key'][rows] == batch['key']
+            if found.any():
+                keep = np.ones(len(arrays['key']), dtype=bool)
+                keep[rows[found]] = False
+                renumber = np.cumsum(keep) - 1
+                order = renumber[order[keep[order]]]
+                arrays = {name: values[keep] for name, values in arrays.items()}
+
+        delta = np.argsort(batch[sort_column], kind='stable')
+        batch = {name: values[delta] for name, values in batch.items()}
+        at = np.searchsorted(arrays[sort_column], batch[sort_column], side='right')
+        merged = {name: np.insert(values, at, batch[name]) for name, values in arrays.items()}
+
+        # Старая строка i сдвигается на число вставок перед ней, новая
+        # строка j встает на at[j] + j; индекс по ключу сливается так же
+        size = len(arrays['key'])
+        old_rows = np.arange(size) + np.searchsorted(at, np.arange(size), side='right')
+        new_rows = at + np.arange(len(at))
+        by_key = np.argsort(batch['key'], kind='stable')
+        key_at = np.searchsorted(arrays['key'][order], batch['key'][by_key], side='right')
+        return merged, np.insert(old_rows[order], key_at, new_rows[by_key])
+
+    async def _layout(self, session: AsyncSession) -> tuple:
+        # После полной перезагрузки таблицы создаются заново и получают новые
+        # OID, а после отсоединения старых секций часть снапшотов пропадает:
+        # в обоих случаях реплику надо строить с нуля, а не дополнять
+        result = await session.execute(text(
+            "SELECT 'videos'::regclass::oid, 'video_snapshots'::regclass::oid, current_setting('TimeZone')"
+        ))
+        videos, snapshots, timezone_name = result.one()
+        result = await session.execute(
+            text("SELECT inhrelid FROM pg_inherits WHERE inhparent = 'video_snapshots'::regclass")
+        )
+        return (videos, snapshots), {row[0] for row in result}, timezone_name
+
+    async def refresh(self, session: AsyncSession, version):
+        if self.version == version and self.ready:
+            return
+        if self._lock.locked():
+            # Обновление уже идет: этот запрос ответит PostgreSQL
+            return
+
+        async with self._lock:
+            started = time.perf_counter()
+            oids, partitions, timezone_name = await self._layout(session)
+            full = oids != self._oids or bool(self._partitions - partitions)
+            # Новая копия собирается рядом со старой и подменяет ее целиком
+            if full:
+                tables, orders, marks, creators = {}, {}, {}, {}
+            else:
+                tables, orders, marks, creators = dict(self._tables), dict(self._orders), dict(self._marks), self.creators
+
+            for table in TABLES:
+                batch, mark = await self._fetch(session, table, marks.get(table), creators)
+                tables[table], orders[table] = await asyncio.to_thread(
+                    self._merge, table, tables.get(table), orders.get(table), batch
+                )
+                marks[table] = mark
+
+            self._tables, self._orders, self._marks, self.creators = tables, orders, marks, creators
+            self.timezone = _zone(timezone_name)
+            self._oids = oids
+            self._partitions = partitions
+            self.version = version
+            if full:
+                self.rebuilds += 1
+            else:
+                self.refreshes += 1
+            logger.info(
+                f"Колоночная реплика {'построена' if full else 'обновлена'} за {time.perf_counter() - started:.2f} с: "
+                f"{len(self._tables['videos']['key'])} видео, {len(self._tables['video_snapshots']['key'])} снапшотов, "
+                f"версия {version}"
+            )
+
+    def _local(self, value: datetime) -> datetime:
+        # Время без зоны PostgreSQL читает в зоне сессии (TimeZone); если
+        # ее не удалось разобрать, такое условие считает сама БД
+        if value.tzinfo is not None:
+            return value
+        if self.timezone is None:
+            raise ValueError("зона сессии")
+        return value.replace(tzinfo=self.timezone)
+
+    def _value(self, column: str, raw: str, params: dict):
+        if raw.startswith(':'):
+            value = params[raw[1:]]
+        elif raw.startswith("'"):
+            value = raw[1:-1]
+        else:
+            value = int(raw)
+
+        if column == 'creator_id':
+            if not isinstance(value, str):
+                raise ValueError(column)
+            return self.creators.get(value, -2)
+        if column in _TIMESTAMPS:
+            if isinstance(value, str):
+                return to_micros(self._local(datetime.fromisoformat(_TZ_SUFFIX_RE.sub(r'\1:00', value.strip()))))
+            # Параметр без зоны драйвер переводит по локальному времени
+            # процесса, а не по зоне сессии: такой запрос считает сама БД
+            if not isinstance(value, datetime) or value.tzinfo is None:
+                raise ValueError(column)
+            return to_micros(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(column)
+        return value
+
+    def _conditions(self, table: str, where: Optional[str], params: dict) -> Optional[list]:
+        conditions = []
+        if where is None:
+            return conditions
+
+        for part in where.split(' and '):
+            m = _CONDITION_RE.fullmatch(part.strip())
+            if m is None:
+                return None
+            column = m['date'] or m['column']
+            if column not in TABLES[table]['columns']:
+                return None
+
+            if m['date']:
+                # DATE(col) = 'YYYY-MM-DD' превращается в полуоткрытый диапазон
+                # суток в зоне сессии, как считает PostgreSQL
+                if column not in _TIMESTAMPS or m['op'] != '=' or not m['value'].startswith("'"):
+                    return None
+                day = date.fromisoformat(m['value'][1:-1])
+                start = self._local(datetime.combine(day, datetime.min.time()))
+                end = self._local(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+                conditions.append((column, '>=', to_micros(start)))
+                conditions.append((column, '<', to_micros(end)))
+                continue
+
+            if column == 'creator_id' and m['op'] != '=':
+                return None
+            conditions.append((column, m['op'], self._value(column, m['value'], params)))
+        return conditions
+
+    def _scan(self, table: str, conditions: list):
+        # Условия по столбцу сортировки сужают срез бинарным поиском,
+        # остальные применяются к срезу как векторные маски
+        np = self.np
+        arrays = self._tables[table]
+        sort_column = TABLES[table]['sort']
+        times = arrays[sort_column]
+        lo, hi = 0, len(times)
+        masks = []
+
+        for column, op, value in conditions:
+            if column == sort_column:
+                # Строки с NULL во времени стоят в начале и в срез не входят
+                lo = max(lo, int(np.searchsorted(times, NULL, side='right')))
+                if op in ('>=', '='):
+                    lo = max(lo, int(np.searchsorted(times, value, side='left')))
+                if op == '>':
+                    lo = max(lo, int(np.searchsorted(times, value, side='right')))
+                if op in ('<=', '='):
+                    hi = min(hi, int(np.searchsorted(times, value, side='right')))
+                if op == '<':
+                    hi = min(hi, int(np.searchsorted(times, value, side='left')))
+            else:
+                masks.append((column, op, value))
+
+        hi = max(lo, hi)
+        mask = None
+        for column, op, value in masks:
+            values = arrays[column][lo:hi]
+            null = NULL_CREATOR if column == 'creator_id' else NULL
+            if op == '=':
+                current = values == value
+            elif op == '>':
+                current = values > value
+            elif op == '>=':
+                current = values >= value
+            elif op == '<':
+                current = values < value
+            else:
+                current = values <= value
+            if op in ('<', '<=') or value <= null:
+                current &= values != null
+            mask = current if mask is None else mask & current
+        return lo, hi, mask
+
+    def answer(self, query: str, params: Optional[dict] = None) -> Optional[str]:
+        if not self.ready:
+            return None
+
+        m = _SELECT_RE.fullmatch(normalize_sql(query))
+        if m is None or m['table'] not in self._tables:
+            self.fallbacks += 1
+            return None
+
+        table = m['table']
+        aggregated = m['distinct'] or m['sum'] or m['coalesce']
+        if aggregated and aggregated not in TABLES[table]['columns']:
+            self.fallbacks += 1
+            return None
+
+        try:
+            conditions = self._conditions(table, m['where'], params or {})
+        except (KeyError, ValueError) as e:
+            logger.debug(f"Реплика не разобрала условие: {e}")
+            conditions = None
+        if conditions is None:
+            self.fallbacks += 1
+            return None
+
+        lo, hi, mask = self._scan(table, conditions)
+        if aggregated is None:
+            value = hi - lo if mask is None else int(self.np.count_nonzero(mask))
+        else:
+            values = self._tables[table][aggregated][lo:hi]
+            if mask is not None:
+                values = values[mask]
+            # NULL не входит ни в COUNT(DISTINCT), ни в SUM
+            values = values[values != (NULL_CREATOR if aggregated == 'creator_id' else NULL)]
+            if m['distinct']:
+                value = int(self.np.unique(values).size)
+            else:
+                value = int(values.sum())
+
+        self.answered += 1
+        return str(value)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "videos": len(self._tables['videos']['key']) if self.ready else 0,
+            "snapshots": len(self._tables['video_snapshots']['key']) if self.ready else 0,
+            "answered": self.answered,
+            "fallbacks": self.fallbacks,
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+        }
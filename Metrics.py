@@ -0,0 +1,125 @@
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    # Логарифмически-линейные корзины в стиле HdrHistogram: значение в
+    # микросекундах хранится с точностью ~1% (sub_bits значащих бит),
+    # память не зависит от числа наблюдений
+    def __init__(self, sub_bits: int = 7):
+        self.sub_bits = sub_bits
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets = Counter()
+
+    def record(self, seconds: float):
+        value = max(1, int(seconds * 1e6))
+        shift = max(0, value.bit_length() - self.sub_bits)
+        self._buckets[(shift, value >> shift)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+
+        rank = p / 100 * self.count
+        seen = 0
+        for (shift, mantissa), count in sorted(self._buckets.items()):
+            seen += count
+            if seen >= rank:
+                return ((mantissa << shift) + ((1 << shift) >> 1)) / 1e6
+        return self.max
+
+
+class Metrics:
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self._stats_sources = {}
+
+    def observe(self, stage: str, seconds: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def register_stats(self, name: str, source: Callable[[], dict]):
+        # Источник возвращает словарь, числовые значения из него
+        # попадают в отчет как gauge-метрики
+        self._stats_sources[name] = source
+
+    def _gauges(self):
+        for name, source in self._stats_sources.items():
+            try:
+                stats = source()
+            except Exception as e:
+                logger.error(f"Не удалось получить статистику {name}: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield f"{name}_{key}", value
+
+    def render_text(self) -> str:
+        lines = ["Задержки по этапам (p50 / p95 / p99, мс):"]
+        for stage, histogram in self.histograms.items():
+            values = " / ".join(f"{histogram.percentile(p) * 1000:.1f}" for p in self.PERCENTILES)
+            lines.append(f"{stage}: {values} (n={histogram.count})")
+
+        if self.counters:
+            lines.append("")
+            lines.append("Счетчики:")
+            lines.extend(f"{name}: {value}" for name, value in sorted(self.counters.items()))
+
+        gauges = list(self._gauges())
+        if gauges:
+            lines.append("")
+            lines.append("Состояние:")
+            lines.extend(
+                f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+                for name, value in gauges
+            )
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP bot_stage_latency_seconds Задержка этапов обработки запроса",
+            "# TYPE bot_stage_latency_seconds summary",
+        ]
+        for stage, histogram in self.histograms.items():
+            for p in self.PERCENTILES:
+                lines.append(
+                    f'bot_stage_latency_seconds{{stage="{stage}",quantile="{p / 100}"}} {histogram.percentile(p):.6f}'
+                )
+            lines.append(f'bot_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+            lines.append(f'bot_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE bot_{name}_total counter")
+            lines.append(f"bot_{name}_total {value}")
+
+        for name, value in self._gauges():
+            lines.append(f"# TYPE bot_{name} gauge")
+            lines.append(f"bot_{name} {value}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,196 @@
+import re
+import asyncio
+import sqlite3
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+RU_MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4,
+    'мая': 5, 'июня': 6, 'июля': 7, 'августа': 8,
+    'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+
+_MONTHS_PATTERN = '|'.join(RU_MONTHS)
+_RANGE_RE = re.compile(rf'\bс\s+(\d{{1,2}})\s+по\s+(\d{{1,2}})\s+({_MONTHS_PATTERN})\s+(\d{{4}})', re.IGNORECASE)
+_DATE_RE = re.compile(rf'\b(\d{{1,2}})\s+({_MONTHS_PATTERN})\s+(\d{{4}})', re.IGNORECASE)
+_NUMERIC_DATE_RE = re.compile(r'\b(\d{1,2})\.(\d{1,2})\.(\d{4})\b')
+_YEAR_SUFFIX_RE = re.compile(r'\b(\d{4}-\d{2}-\d{2})\s+(?:года|год|г\.?)(?=\s|$)', re.IGNORECASE)
+_PUNCT_RE = re.compile(r'[?!.,;:«»"]+(?=\s|$)')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def _iso(year, month, day) -> str:
+    return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+
+
+def normalize_question(question: str, keep_case: bool = False) -> str:
+    # Приводим вопрос к каноническому виду, чтобы разные написания
+    # одного и того же вопроса попадали в один ключ кеша. С keep_case=True
+    # регистр сохраняется: из такого текста извлекаются значения параметров
+    text = question.replace('ё', 'е').replace('Ё', 'Е')
+    if not keep_case:
+        text = text.lower()
+    text = _SPACES_RE.sub(' ', text).strip()
+
+    text = _RANGE_RE.sub(
+        lambda m: f"с {_iso(m[4], RU_MONTHS[m[3].lower()], m[1])} по {_iso(m[4], RU_MONTHS[m[3].lower()], m[2])}",
+        text
+    )
+    text = _DATE_RE.sub(lambda m: _iso(m[3], RU_MONTHS[m[2].lower()], m[1]), text)
+    text = _NUMERIC_DATE_RE.sub(lambda m: _iso(m[3], m[2], m[1]), text)
+    text = _YEAR_SUFFIX_RE.sub(r'\1', text)
+    text = _PUNCT_RE.sub('', text)
+
+    return _SPACES_RE.sub(' ', text).strip()
+
+
+class QueryCache:
+    def __init__(
+            self,
+            max_size: int = 1000,
+            ttl: float = 24 * 3600,
+            path: Optional[str] = None
+        ):
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        # key -> (sql, created_at, latency)
+        self._entries: OrderedDict = OrderedDict()
+        # Изменения с последнего сброса на диск: key -> last_used и удаленные ключи
+        self._dirty = {}
+        self._deleted = set()
+        self._db = None
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+        if path:
+            self._open_db(path)
+
+    def _open_db(self, path: str):
+        # Запись идет из потока asyncio.to_thread, по одному сбросу за раз
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache ("
+            "key TEXT PRIMARY KEY, sql TEXT NOT NULL, created_at REAL NOT NULL, "
+            "last_used REAL NOT NULL, latency REAL NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("DELETE FROM query_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        rows = self._db.execute(
+            "SELECT key, sql, created_at, latency FROM query_cache ORDER BY last_used DESC LIMIT ?",
+            (self.max_size,)
+        ).fetchall()
+        self._db.commit()
+
+        for key, sql, created_at, latency in reversed(rows):
+            self._entries[key] = (sql, created_at, latency)
+        logger.info(f"Кеш запросов загружен из {path}: {len(self._entries)} записей")
+
+    def start(self, interval: float = 5.0):
+        # LRU ведется в памяти, на диск изменения уходят пачкой раз в interval
+        # секунд в отдельном потоке: попадание в кеш не ждет SQLite
+        if self._db is not None and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(interval))
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить кеш запросов: {e}")
+
+    def get(self, question: str) -> Optional[str]:
+        key = normalize_question(question)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        sql, created_at, latency = entry
+        now = time.time()
+        if now - created_at > self.ttl:
+            self._delete(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += latency
+        self._dirty[key] = now
+        return sql
+
+    def put(self, question: str, sql: str, latency: float = 0.0):
+        key = normalize_question(question)
+        now = time.time()
+
+        self._entries[key] = (sql, now, latency)
+        self._entries.move_to_end(key)
+        self._dirty[key] = now
+        self._deleted.discard(key)
+
+        while len(self._entries) > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._delete(oldest_key)
+
+    def discard(self, question: str):
+        # SQL, который не удалось выполнить в БД, больше не выдаем
+        self._delete(normalize_question(question))
+
+    def _delete(self, key: str):
+        self._entries.pop(key, None)
+        self._dirty.pop(key, None)
+        self._deleted.add(key)
+
+    async def flush(self):
+        if self._db is None:
+            return
+        async with self._flush_lock:
+            if not self._dirty and not self._deleted:
+                return
+            rows = [
+                (key, *self._entries[key], last_used)
+                for key, last_used in self._dirty.items() if key in self._entries
+            ]
+            deleted = [(key,) for key in self._deleted]
+            self._dirty, self._deleted = {}, set()
+            await asyncio.to_thread(self._write, rows, deleted)
+
+    def _write(self, rows: list, deleted: list):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO query_cache (key, sql, created_at, latency, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self._db.executemany("DELETE FROM query_cache WHERE key = ?", deleted)
+        self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._db is not None:
+            await self.flush()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,80 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from ResultCache import cache_key
+
+logger = logging.getLogger(__name__)
+
+QUERY_CANCELED_SQLSTATE = '57014'
+
+
+def is_statement_timeout(error: Exception) -> bool:
+    # asyncpg кладет SQLSTATE в атрибут sqlstate: подготовленный запрос
+    # (StatementCache) бросает исключение asyncpg напрямую, text() — обернутым
+    # в исключение SQLAlchemy с исходным в orig
+    orig = getattr(error, 'orig', None)
+    for candidate in (error, orig, getattr(orig, '__cause__', None)):
+        if getattr(candidate, 'sqlstate', None) == QUERY_CANCELED_SQLSTATE:
+            return True
+    return False
+
+
+class QueryGuard:
+    def __init__(self, max_cost: float = 5e6, cache_size: int = 1000):
+        self.max_cost = max_cost
+        self.cache_size = cache_size
+        self.admitted = 0
+        self.rejected = 0
+        self.aborted = 0
+        self.explain_errors = 0
+        self._costs: OrderedDict = OrderedDict()
+
+    async def plan_cost(self, session: AsyncSession, query: str, params: Optional[dict] = None) -> float:
+        # Стоимость зависит от литералов (диапазон дат, креатор): кешируем
+        # по полному тексту с параметрами, а не по виду запроса
+        key = cache_key(query, params)
+        cost = self._costs.get(key)
+        if cost is not None:
+            self._costs.move_to_end(key)
+            return cost
+
+        result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')}"), params or {})
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        cost = float(plan[0]["Plan"]["Total Cost"])
+
+        self._costs[key] = cost
+        while len(self._costs) > self.cache_size:
+            self._costs.popitem(last=False)
+        return cost
+
+    async def admit(self, session: AsyncSession, query: str, params: Optional[dict] = None) -> bool:
+        try:
+            cost = await self.plan_cost(session, query, params)
+        except Exception as e:
+            logger.error(f"Не удалось получить план запроса: {e}, SQL: {query[:200]}...")
+            await session.rollback()
+            self.explain_errors += 1
+            self.rejected += 1
+            return False
+
+        if cost > self.max_cost:
+            logger.warning(f"Запрос отклонен: стоимость плана {cost:.0f} > {self.max_cost:.0f}, SQL: {query[:200]}...")
+            self.rejected += 1
+            return False
+
+        self.admitted += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "aborted": self.aborted,
+            "explain_errors": self.explain_errors,
+            "cached_plans": len(self._costs),
+        }
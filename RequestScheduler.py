@@ -0,0 +1,122 @@
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class RequestSuperseded(Exception):
+    # Запрос снят с очереди: пользователь задал новый вопрос раньше, чем до него дошла очередь
+    pass
+
+
+class RequestScheduler:
+    def __init__(self, workers: int = 16, db_limit: int = 10, metrics=None):
+        self.workers = workers
+        self.metrics = metrics
+        # Лимит соединений БД. Запросы к LLM ограничивает сам SqlQueryGenerator
+        # и только на время HTTP-запроса: ожидающие чужой результат лимит не занимают
+        self.db = asyncio.Semaphore(db_limit)
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._pending = {}
+        self._active = set()
+        self._ready = asyncio.Queue()
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Планировщик запущен: {self.workers} обработчиков")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for queue in self._pending.values():
+            for future, _, _ in queue:
+                future.cancel()
+        self._pending.clear()
+
+    def submit(self, user_id: int, job: Callable[[], Awaitable]) -> asyncio.Future:
+        # Новый вопрос пользователя вытесняет его еще не начатые запросы:
+        # отвечать на устаревшие вопросы уже нет смысла
+        queue = self._pending.setdefault(user_id, deque())
+        while queue:
+            future, _, _ = queue.popleft()
+            if not future.done():
+                future.set_exception(RequestSuperseded())
+            self.dropped += 1
+            logger.info(f"Устаревший запрос пользователя {user_id} отменен")
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((future, job, time.monotonic()))
+        self.submitted += 1
+
+        # Пользователь попадает в очередь на обслуживание только один раз:
+        # пока его запрос выполняется, остальные ждут, а обработчики
+        # берут пользователей по кругу
+        if user_id not in self._active:
+            self._active.add(user_id)
+            self._ready.put_nowait(user_id)
+        return future
+
+    async def _worker(self):
+        while True:
+            user_id = await self._ready.get()
+            queue = self._pending.get(user_id)
+
+            if not queue:
+                self._active.discard(user_id)
+                self._pending.pop(user_id, None)
+                continue
+
+            future, job, enqueued_at = queue.popleft()
+            wait = time.monotonic() - enqueued_at
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if self.metrics is not None:
+                self.metrics.observe("queue", wait)
+
+            try:
+                result = await job()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки запроса пользователя {user_id}: {e}", exc_info=True)
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.completed += 1
+                if not future.done():
+                    future.set_result(result)
+
+            if queue:
+                self._ready.put_nowait(user_id)
+            else:
+                self._active.discard(user_id)
+                self._pending.pop(user_id, None)
+
+    def stats(self) -> dict:
+        started = self.completed + self.failed
+        return {
+            "queued": sum(len(queue) for queue in self._pending.values()),
+            "active_users": len(self._active),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "wait_avg": self.wait_total / started if started else 0.0,
+            "wait_max": self.wait_max,
+        }
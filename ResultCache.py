@@ -0,0 +1,104 @@
+import re
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+_LITERAL_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_sql(query: str) -> str:
+    # Регистр и пробелы приводим к одному виду только вне строковых
+    # литералов и идентификаторов в кавычках
+    parts = _LITERAL_RE.split(query.strip().rstrip(';'))
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            normalized.append(part)
+        else:
+            normalized.append(_SPACES_RE.sub(' ', part).lower())
+    return ''.join(normalized).strip()
+
+
+def cache_key(query: str, params: Optional[dict] = None) -> tuple:
+    return normalize_sql(query), tuple(sorted((params or {}).items()))
+
+
+class ResultCache:
+    def __init__(self, max_size: int = 1000, version_check_interval: float = 5.0):
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._checked_at = 0.0
+        self._entries: OrderedDict = OrderedDict()
+
+    async def refresh_version(self, session: AsyncSession):
+        # Версию данных читаем не чаще раза в version_check_interval секунд,
+        # чтобы попадание в кеш не требовало обращения к БД
+        now = time.monotonic()
+        if now - self._checked_at < self.version_check_interval:
+            return
+        self._checked_at = now
+
+        try:
+            result = await session.execute(text("SELECT version FROM data_version WHERE id = 1"))
+            version = result.scalar()
+        except Exception as e:
+            logger.error(f"Не удалось прочитать версию данных: {e}")
+            await session.rollback()
+            version = None
+
+        if version != self.version:
+            logger.info(f"Версия данных изменилась: {self.version} -> {version}, сбрасываем кеш результатов")
+            self._entries.clear()
+            self.version = version
+
+    def get(self, query: str, params: Optional[dict] = None) -> Optional[str]:
+        if self.version is None:
+            return None
+
+        key = cache_key(query, params)
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, query: str, value: str, params: Optional[dict] = None):
+        if self.version is None:
+            return
+
+        key = cache_key(query, params)
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def shared_key(self, query: str, params: Optional[dict] = None) -> Optional[str]:
+        # Ключ для общего хранилища (StateBackend): версия данных входит в ключ,
+        # поэтому после загрузки старые результаты просто перестают читаться
+        if self.version is None:
+            return None
+        digest = hashlib.sha1(repr(cache_key(query, params)).encode('utf-8')).hexdigest()
+        return f"result:{self.version}:{digest}"
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
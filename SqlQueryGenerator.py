@@ -1,22 +1,221 @@
 import aiohttp
 import asyncio
+import json
+import time
 import logging
+from collections import Counter
+from typing import Callable, Optional
+from QueryCache import normalize_question
+from Metrics import Histogram
+from sqlalchemy.dialects import postgresql
+from database.models import Base, SERVICE_TABLES, rollups_metadata
 
 logger = logging.getLogger(__name__)
 
+_COMPACT_RULES = """Правила:
+- даты в UTC; период: col >= 'YYYY-MM-DD 00:00:00+00' AND col < 'YYYY-MM-DD 00:00:00+00' (верхняя граница всегда через <)
+- "28 ноября 2025" -> DATE(col) = '2025-11-28'; "с 3 по 10 ноября 2025 включительно" -> col >= '2025-11-03 00:00:00+00' AND col < '2025-11-11 00:00:00+00'
+- videos.*_count — итоговые значения; video_snapshots.*_count — на момент замера (раз в час), delta_* — прирост с прошлого замера
+- video_snapshots секционирована по created_at: фильтруй диапазоном по created_at, не DATE(created_at)
+- у video_snapshots нет creator_id: JOIN videos ON videos.id = video_snapshots.video_id
+- суммы delta_* по целым дням/часам бери из *_daily_stats / *_hourly_stats
+- ответ: один SELECT, возвращающий одно число, без пояснений"""
+
+
+def compact_schema(*metadatas, exclude=()) -> str:
+    # Схема в одну строку на таблицу, собирается из моделей, поэтому
+    # не расходится с БД и занимает в несколько раз меньше токенов. Типы
+    # печатаются диалектом PostgreSQL: без него timestamptz выглядит как datetime
+    dialect = postgresql.dialect()
+    lines = []
+    for metadata in metadatas:
+        for table in metadata.tables.values():
+            if table.name in exclude:
+                continue
+            columns = ", ".join(
+                f"{column.name} {column.type.compile(dialect=dialect).lower()}" for column in table.columns
+            )
+            lines.append(f"{table.name}({columns})")
+    return "\n".join(lines)
+
+
+def complete_statement(text: str) -> Optional[str]:
+    # Возвращает SQL, как только в потоке закончился первый оператор:
+    # встретилась ';' или закрывающая ``` вне строковых литералов
+    body = text.lstrip()
+    if body.startswith('```'):
+        newline = body.find('\n')
+        if newline == -1:
+            return None
+        body = body[newline + 1:]
+
+    quote = None
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == ';':
+            return body[:i].strip()
+        elif body.startswith('```', i):
+            return body[:i].strip() or None
+        i += 1
+    return None
+
+
+def split_statements(text: str) -> list:
+    # Ответ с несколькими запросами делим по ';' вне строковых литералов
+    body = text.replace('```sql', '').replace('```', '')
+    statements = []
+    quote = None
+    start = 0
+    for i, char in enumerate(body):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == ';':
+            statements.append(body[start:i].strip())
+            start = i + 1
+    statements.append(body[start:].strip())
+    return [statement for statement in statements if statement]
+
+
+def parse_backends(spec: str, default_url: str) -> list:
+    # "model1,model2@https://host/v1/chat/completions": порядок задает
+    # приоритет, адрес без @ берется по умолчанию
+    backends = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, url = item.partition('@')
+        backends.append((model.strip(), url.strip() or default_url))
+    return backends
+
+
+class LlmBackend:
+    # Модель и адрес API со своей статистикой и автоматом отключения:
+    # после failure_threshold ошибок подряд бэкенд пропускается cooldown
+    # секунд, затем пропускается один пробный запрос
+    def __init__(self, model: str, base_url: str, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.model = model
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latency = Histogram()
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.invalid = 0
+        self.skipped = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self._probing else "open"
+
+    def available(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self._probing and time.monotonic() - self.opened_at >= self.cooldown:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self, seconds: float):
+        self.successes += 1
+        self.latency.record(seconds)
+        self.consecutive_failures = 0
+        if self.opened_at is not None:
+            logger.info(f"LLM {self.model} снова доступна")
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self._probing or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            logger.warning(
+                f"LLM {self.model} отключена на {self.cooldown:.0f} с после {self.consecutive_failures} ошибок подряд"
+            )
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def record_cancel(self):
+        # Проигравший запрос отменен: пробу нужно разрешить снова
+        self._probing = False
+
+    def stats(self) -> dict:
+        finished = self.successes + self.failures
+        return {
+            "model": self.model,
+            "state": self.state,
+            "open": int(self.opened_at is not None),
+            "calls": self.calls,
+            "successes": self.successes,
+            "failures": self.failures,
+            "invalid": self.invalid,
+            "skipped": self.skipped,
+            "success_rate": self.successes / finished if finished else 0.0,
+            "latency_p50": self.latency.percentile(50),
+            "latency_p95": self.latency.percentile(95),
+        }
+
+
 class SqlQueryGenerator:
     def __init__(
             self, 
             api_key: str, 
             model: str = "arcee-ai/trinity-large-preview:free",
             base_url: str = "https://openrouter.ai/api/v1/chat/completions",
-            max_tokens: int = 1000
+            max_tokens: int = 1000,
+            max_concurrency: int = 8,
+            connection_limit: int = 16,
+            timeout: float = 180,
+            stream: bool = False,
+            compact_prompt: bool = False,
+            backends: Optional[list] = None,
+            hedge_after: float = 10.0,
+            failure_threshold: int = 3,
+            cooldown: float = 30.0,
+            validator: Optional[Callable[[str], bool]] = None,
+            drain_timeout: float = 2.0
         ):
                         
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
+        # Цепочка моделей по приоритету; без настройки — одна модель по умолчанию
+        self.backends = [
+            LlmBackend(backend_model, backend_url, failure_threshold, cooldown)
+            for backend_model, backend_url in (backends or [(model, base_url)])
+        ]
+        self.hedge_after = hedge_after
+        self.validator = validator
+        self.hedged = 0
+        self.fallback_wins = 0
         self.max_tokens = max_tokens
+        self.max_concurrency = max_concurrency
+        self.connection_limit = connection_limit
+        self.timeout = timeout
+        self.stream = stream
+        self.drain_timeout = drain_timeout
+        self.compact_prompt = compact_prompt
+        self.coalesced = 0
+        self.usage = Counter()
+        self._session = None
+        self._semaphore = None
+        self._inflight = {}
+        self._drains = set()
         self._DEFAULT_SYSTEM_PROMPT: str = "Ты — опытный SQL-разработчик PostgreSQL."
         self._DEFAULT_USER_PROMPT: str = (        
             """
@@ -46,10 +245,16 @@ class SqlQueryGenerator:
             - created_at (TIMESTAMPTZ) - время замера (раз в час)
             - updated_at (TIMESTAMPTZ)
 
+            3. ВИТРИНЫ (заранее посчитанные суммы приращений из video_snapshots):
+            - video_daily_stats: video_id, creator_id, day (DATE, UTC), delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count, snapshots_count
+            - creator_daily_stats: creator_id, day (DATE, UTC), delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count, snapshots_count
+            - creator_hourly_stats: creator_id, hour (TIMESTAMPTZ, начало часа), delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count, snapshots_count
+
             ВАЖНО:
             1. Все даты и время в БД хранятся в UTC (+00:00)
             2. Для фильтрации по дате видео используй DATE(video_created_at)
-            3. Для фильтрации по дате снапшотов используй DATE(created_at)
+            3. Для фильтрации снапшотов по дате используй диапазон по created_at, а не DATE(created_at) (так читаются только нужные секции таблицы):
+            - created_at >= '2025-11-28 00:00:00+00' AND created_at < '2025-11-29 00:00:00+00'
             4. Для фильтрации по точному времени внутри дня указывай часовой пояс UTC (+00):
             - created_at >= '2025-11-28 10:00:00+00'
             - created_at < '2025-11-28 15:00:00+00'
@@ -58,6 +263,8 @@ class SqlQueryGenerator:
             - video_created_at < '2025-11-06 00:00:00+00'
             6. В таблице video_snapshots НЕТ поля creator_id. Для фильтрации снапшотов по креатору используй JOIN с таблицей videos
             7. Всегда используй '<' вместо '<=' для верхней границы временного интервала
+            8. Если нужны только суммы приращений (delta_*) по целым дням или часам, используй витрины вместо video_snapshots:
+            - "на сколько выросли просмотры 28 ноября 2025" -> SELECT SUM(delta_views_count) FROM creator_daily_stats WHERE day = '2025-11-28'
 
             ДАТЫ в русском формате конвертируй в SQL-формат:
             - "28 ноября 2025" -> DATE(column) = '2025-11-28'
@@ -69,11 +276,159 @@ class SqlQueryGenerator:
             SQL-ЗАПРОС (ТОЛЬКО КОД):
             """
         )
+        self._COMPACT_USER_PROMPT: str = (
+            "Схема PostgreSQL:\n"
+            + compact_schema(Base.metadata, rollups_metadata, exclude=SERVICE_TABLES).replace("{", "{{").replace("}", "}}")
+            + "\n" + _COMPACT_RULES
+            + "\nВопрос: {user_query}\nSQL:"
+        )
         
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Одна сессия на процесс: соединение с API переиспользуется
+        # (keep-alive), DNS кешируется, TLS-рукопожатие не повторяется
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        for task in list(self._drains):
+            task.cancel()
+        if self._drains:
+            await asyncio.gather(*self._drains, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     async def generate_query(self, user_query: str) -> str:
+        # Одинаковые вопросы, пришедшие пока запрос к LLM еще выполняется,
+        # ждут результат этого же запроса
+        key = normalize_question(user_query)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.info(f"Запрос уже выполняется, ожидаем его результат: {user_query}")
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._generate_query(user_query))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _generate_query(self, user_query: str) -> str:
         logger.info(f"Генерация SQL для запроса: {user_query}")
-        
-        full_prompt = self._DEFAULT_USER_PROMPT.format(user_query=user_query)
+
+        def accept(sql_response: str) -> Optional[str]:
+            if self.validator is not None and not self.validator(sql_response):
+                return None
+            return sql_response
+
+        return await self._hedged(user_query, accept, stop_early=True)
+
+    async def generate_batch(self, user_queries: list) -> list:
+        # Несколько вопросов одного сообщения — одно обращение к LLM:
+        # модель возвращает запросы в порядке вопросов через ';'.
+        # Проверку безопасности каждого запроса делает вызывающий код
+        logger.info(f"Генерация SQL для {len(user_queries)} вопросов одним запросом")
+        questions = "\n".join(f"{i}. {question}" for i, question in enumerate(user_queries, 1))
+        batch_query = (
+            f"{questions}\n\nЭто {len(user_queries)} отдельных вопросов. Для каждого верни один SELECT, "
+            f"возвращающий одно число, в том же порядке; каждый запрос заканчивай символом ';'"
+        )
+
+        def accept(text: str) -> Optional[list]:
+            statements = split_statements(text)
+            return statements if len(statements) == len(user_queries) else None
+
+        return await self._hedged(batch_query, accept, stop_early=False)
+
+    async def _hedged(self, user_query: str, accept: Callable[[str], Optional[object]], stop_early: bool):
+        # Запрос уходит первой доступной модели цепочки. Если ответа нет
+        # дольше hedge_after секунд, пришла ошибка или accept отверг ответ,
+        # запускается следующая модель; побеждает первый принятый ответ
+        remaining = list(self.backends)
+        backends = {}
+        pending = set()
+        errors = []
+
+        def launch() -> Optional[LlmBackend]:
+            while remaining:
+                backend = remaining.pop(0)
+                if backend.available():
+                    task = asyncio.ensure_future(self._request(backend, user_query, stop_early))
+                    backends[task] = backend
+                    pending.add(task)
+                    return backend
+                backend.skipped += 1
+            return None
+
+        if launch() is None:
+            raise RuntimeError("Все модели LLM временно отключены")
+
+        try:
+            while pending:
+                timeout = self.hedge_after if remaining and self.hedge_after else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+                if not done:
+                    backend = launch()
+                    if backend is not None:
+                        self.hedged += 1
+                        logger.info(f"Нет ответа за {self.hedge_after} с, дублируем запрос в {backend.model}")
+                    continue
+
+                for task in done:
+                    backend = backends[task]
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        errors.append(f"{backend.model}: {e}")
+                        response = None
+                    accepted = accept(response) if response is not None else None
+                    if response is not None and accepted is None:
+                        backend.invalid += 1
+                        errors.append(f"{backend.model}: ответ не прошел проверку")
+                        logger.warning(f"LLM {backend.model} вернула неподходящий ответ: {response}")
+
+                    if accepted is not None:
+                        if backend is not self.backends[0]:
+                            self.fallback_wins += 1
+                        return accepted
+                    launch()
+
+            raise RuntimeError(f"Ни одна модель не вернула SQL: {'; '.join(errors)}")
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in backends:
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+    async def _request(self, backend: LlmBackend, user_query: str, stop_early: bool = True) -> str:
+        backend.calls += 1
+        started = time.perf_counter()
+        try:
+            sql_response = await self._call(backend, user_query, stop_early)
+        except asyncio.CancelledError:
+            backend.record_cancel()
+            raise
+        except Exception:
+            backend.record_failure()
+            raise
+        backend.record_success(time.perf_counter() - started)
+        return sql_response
+
+    async def _call(self, backend: LlmBackend, user_query: str, stop_early: bool = True) -> str:
+        prompt = self._COMPACT_USER_PROMPT if self.compact_prompt else self._DEFAULT_USER_PROMPT
+        full_prompt = prompt.format(user_query=user_query)
 
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -81,7 +436,7 @@ class SqlQueryGenerator:
         }
         
         data = {
-            "model": self.model,
+            "model": backend.model,
             "messages": [
                 {"role": "system", "content": self._DEFAULT_SYSTEM_PROMPT},
                 {"role": "user", "content": full_prompt}
@@ -89,17 +444,40 @@ class SqlQueryGenerator:
             "temperature": 0.0,
             "max_tokens": self.max_tokens
         }
+        if self.stream:
+            data["stream"] = True
+            data["usage"] = {"include": True}
 
-        timeout = aiohttp.ClientTimeout(total=180)
+        session = self._get_session()
         
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with self._semaphore:
             try:
-                logger.debug(f"Отправка запроса к LLM API: {self.model}")
-                async with session.post(self.base_url, headers=headers, json=data) as response:
+                logger.debug(f"Отправка запроса к LLM API: {backend.model}")
+                response = await session.post(backend.base_url, headers=headers, json=data)
+                try:
+                    if self.stream and response.status == 200:
+                        sql_response = await self._read_stream(
+                            response, len(self._DEFAULT_SYSTEM_PROMPT) + len(full_prompt), stop_early
+                        )
+                        if not response.content.at_eof():
+                            # Досрочная остановка: хвост ответа дочитываем в фоне,
+                            # чтобы соединение вернулось в пул keep-alive
+                            self._drain(response)
+                            response = None
+                        return sql_response
+
                     raw_text = await response.text()
                     
                     if response.status == 200:
                         result = await response.json()
+                        usage = result.get("usage") or {}
+                        self.usage["calls"] += 1
+                        self.usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                        self.usage["completion_tokens"] += usage.get("completion_tokens", 0)
+                        logger.info(
+                            f"Токены LLM: prompt={usage.get('prompt_tokens')}, "
+                            f"completion={usage.get('completion_tokens')}"
+                        )
                         if "choices" in result and result["choices"]:
                             sql_response = result["choices"][0]["message"]["content"].strip()
                             sql_response = sql_response.replace('```sql', '').replace('```', '').strip()
@@ -109,12 +487,94 @@ class SqlQueryGenerator:
                             logger.error(f"Пустой ответ от LLM API: {raw_text}")
                             raise RuntimeError("Пустой ответ от API")
                     else:
-                        logger.error(f"Ошибка LLM API ({response.status}): {raw_text}")
+                        logger.error(f"Ошибка LLM API {backend.model} ({response.status}): {raw_text}")
                         raise RuntimeError(f"Ошибка API ({response.status})")
-                        
+                finally:
+                    if response is not None:
+                        response.release()
+
             except aiohttp.ClientError as e:
                 logger.error(f"Ошибка сети при обращении к LLM: {e}")
                 raise RuntimeError(f"Ошибка сети: {e}") from e
             except asyncio.TimeoutError:
-                logger.error("Таймаут запроса к LLM (180 сек)")
-                raise RuntimeError("Таймаут запроса: превышено время ожидания (180 сек).")
\ No newline at end of file
+                logger.error(f"Таймаут запроса к LLM {backend.model} ({self.timeout} сек)")
+                raise RuntimeError(f"Таймаут запроса: превышено время ожидания ({self.timeout} сек).")
+
+    def _drain(self, response: aiohttp.ClientResponse):
+        task = asyncio.create_task(self._drain_response(response))
+        self._drains.add(task)
+        task.add_done_callback(self._drains.discard)
+
+    async def _drain_response(self, response: aiohttp.ClientResponse):
+        # Дочитанный до конца ответ освобождает соединение для следующих
+        # запросов; если модель пишет пояснения дольше drain_timeout, дешевле
+        # закрыть соединение (генерация на стороне API при этом прекращается)
+        try:
+            await asyncio.wait_for(self._read_rest(response), self.drain_timeout)
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            response.close()
+            self.usage["stream_closed"] += 1
+        except asyncio.CancelledError:
+            response.close()
+            raise
+        else:
+            response.release()
+            self.usage["stream_drained"] += 1
+
+    @staticmethod
+    async def _read_rest(response: aiohttp.ClientResponse):
+        async for _ in response.content.iter_any():
+            pass
+
+    async def _read_stream(self, response: aiohttp.ClientResponse, prompt_chars: int, stop_early: bool = True) -> str:
+        # Разбираем SSE (data: {...}) и прекращаем чтение, как только пришел
+        # полный оператор: хвост ответа с пояснениями модели не ждем
+        started = time.perf_counter()
+        content = []
+        usage = None
+        sql_response = None
+        chunks = 0
+
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                break
+
+            event = json.loads(payload)
+            if event.get("usage"):
+                usage = event["usage"]
+            for choice in event.get("choices") or []:
+                piece = (choice.get("delta") or {}).get("content")
+                if piece:
+                    content.append(piece)
+                    chunks += 1
+
+            sql_response = complete_statement(''.join(content)) if stop_early else None
+            if sql_response:
+                break
+
+        text = ''.join(content)
+        if not sql_response:
+            sql_response = text.replace('```sql', '').replace('```', '').strip().rstrip(';').strip()
+        if not sql_response:
+            logger.error("Пустой потоковый ответ от LLM API")
+            raise RuntimeError("Пустой ответ от API")
+
+        self.usage["calls"] += 1
+        if usage:
+            self.usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            self.usage["completion_tokens"] += usage.get("completion_tokens", 0)
+            logger.info(f"Токены LLM: prompt={usage.get('prompt_tokens')}, completion={usage.get('completion_tokens')}")
+        else:
+            # При досрочной остановке итоговый usage не приходит: считаем
+            # оценку (~4 символа на токен) отдельно от точных значений
+            self.usage["estimated_prompt_tokens"] += prompt_chars // 4
+            self.usage["estimated_completion_tokens"] += len(text) // 4
+            self.usage["early_stops"] += 1
+            logger.info(f"Токены LLM (оценка): prompt~{prompt_chars // 4}, completion~{len(text) // 4}")
+
+        logger.info(f"LLM вернул SQL (поток, {chunks} фрагментов, {time.perf_counter() - started:.2f} с): {sql_response}")
+        return sql_response
\ No newline at end of file
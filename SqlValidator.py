@@ -0,0 +1,219 @@
+import re
+import logging
+from functools import lru_cache
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Один проход по тексту: каждое совпадение — ровно один токен.
+# Все, что не подходит ни под одну группу, считается ошибкой
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<line_comment>--[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<estring>[eE]'(?:[^'\\]|\\.|'')*')
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<qident>"(?:[^"]|"")+")
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<ident>[a-zA-Z_][a-zA-Z0-9_]*)
+  | (?P<op>::|<=|>=|<>|!=|\|\||[(),.;*+\-/%<>=\[\]])
+""", re.VERBOSE | re.DOTALL)
+
+_SKIPPED = frozenset(('ws', 'line_comment', 'block_comment'))
+
+KEYWORDS = frozenset("""
+    select from where and or not in is null as on join inner left right full outer
+    group by order having limit offset distinct case when then else end between like ilike
+    asc desc with interval true false all any some exists at time zone filter over partition
+    rows range preceding following current row unbounded nulls first last
+    using fetch next only within
+    current_date current_time current_timestamp localtime localtimestamp
+    date timestamp timestamptz bigint integer int smallint numeric decimal real double
+    precision float text varchar char boolean uuid
+    epoch year quarter month week day dow doy hour minute second
+""".split())
+
+# Запрещены в любой позиции, даже там, где разбор принял бы их за псевдоним
+# (например, SELECT ... INTO t создает таблицу). UNION/EXCEPT/INTERSECT и
+# CROSS JOIN склеивают или перемножают таблицы, ответ из одного числа их не требует
+FORBIDDEN = frozenset("""
+    into insert update delete merge drop truncate create alter grant revoke execute exec
+    copy call do lock vacuum analyze set reset listen notify prepare deallocate for
+    current_user session_user union except intersect cross table
+""".split())
+
+# После них на том же уровне скобок список FROM заканчивается
+_FROM_END = frozenset("""
+    where group having order limit offset window on using fetch
+""".split())
+
+FUNCTIONS = frozenset("""
+    count sum avg min max coalesce nullif greatest least round floor ceil ceiling abs trunc
+    mod power sqrt sign
+    date date_trunc date_part date_bin extract cast now age make_date make_timestamptz
+    make_interval to_timestamp to_char to_date timezone
+    lower upper length concat split_part substring position trim replace
+    string_agg array_agg array_length cardinality bool_and bool_or
+    row_number rank dense_rank lag lead first_value last_value
+    percentile_cont percentile_disc stddev variance
+""".split())
+
+
+def tokenize(query: str) -> Optional[list]:
+    # Все токены запроса вместе с пробелами и комментариями, чтобы из них
+    # можно было собрать текст обратно; None — если встретился недопустимый символ
+    tokens = []
+    pos = 0
+    for m in _TOKEN_RE.finditer(query):
+        if m.start() != pos:
+            return None
+        pos = m.end()
+        tokens.append((m.lastgroup, m.group()))
+    return tokens if pos == len(query) else None
+
+
+class SqlValidator:
+    def __init__(self, tables: dict, cache_size: int = 1024):
+        # tables: имя таблицы -> множество имен колонок
+        self.tables = {name.lower(): {c.lower() for c in columns} for name, columns in tables.items()}
+        self.columns = set().union(*self.tables.values()) if self.tables else set()
+        self.check = lru_cache(maxsize=cache_size)(self._check)
+
+    @classmethod
+    def from_metadata(cls, *metadatas, exclude=(), cache_size: int = 1024):
+        tables = {}
+        for metadata in metadatas:
+            for table in metadata.tables.values():
+                if table.name in exclude:
+                    continue
+                tables[table.name] = {column.name for column in table.columns}
+        return cls(tables, cache_size=cache_size)
+
+    def is_safe(self, query: str) -> bool:
+        reason = self.check(query)
+        if reason is not None:
+            logger.warning(f"SQL отклонен: {reason}")
+        return reason is None
+
+    def _check(self, query: str) -> Optional[str]:
+        tokens = []
+        append = tokens.append
+        pos = 0
+
+        for m in _TOKEN_RE.finditer(query):
+            if m.start() != pos:
+                return f"недопустимый символ в позиции {pos}: {query[pos:pos + 20]!r}"
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == 'ident':
+                append((kind, m.group().lower()))
+            elif kind == 'qident':
+                append(('ident', m.group()[1:-1].replace('""', '"').lower()))
+            elif kind not in _SKIPPED:
+                append((kind, m.group()))
+
+        if pos != len(query):
+            return f"недопустимый символ в позиции {pos}: {query[pos:pos + 20]!r}"
+
+        while tokens and tokens[-1] == ('op', ';'):
+            tokens.pop()
+
+        if not tokens:
+            return "пустой запрос"
+        if tokens[0] not in (('ident', 'select'), ('ident', 'with')):
+            return "запрос должен начинаться с SELECT или WITH"
+
+        # Источники после FROM/JOIN проверяются строго по self.tables и уже
+        # объявленным CTE верхнего уровня: псевдоним колонки или подзапроса
+        # (SELECT ... AS pg_roles) не делает таблицу с тем же именем разрешенной.
+        # FROM внутри EXTRACT(... FROM ...) и подобных функций — не список
+        # таблиц: он считается таковым, только если на этом уровне скобок был SELECT
+        aliases = set()
+        ctes = set()
+        pending_cte = None
+        used = []
+        depth = 0
+        selects = [False]
+        from_depths = set()
+        expect_table = False
+        prev_kind, prev = None, None
+
+        for i, (kind, value) in enumerate(tokens):
+            next_token = tokens[i + 1] if i + 1 < len(tokens) else (None, None)
+
+            if expect_table:
+                if kind == 'ident' and value == 'only':
+                    prev_kind, prev = kind, value
+                    continue
+                expect_table = False
+                if kind == 'ident' and next_token != ('op', '(') and value not in FORBIDDEN:
+                    if value not in self.tables and value not in ctes:
+                        return f"таблица не разрешена: {value}"
+                    prev_kind, prev = kind, value
+                    continue
+
+            if kind == 'op':
+                if value == ';':
+                    return "допускается только один оператор"
+                if value == '(':
+                    depth += 1
+                    selects.append(False)
+                elif value == ')':
+                    from_depths.discard(depth)
+                    selects.pop()
+                    depth -= 1
+                    if depth < 0:
+                        return "несбалансированные скобки"
+                    if depth == 0 and pending_cte is not None:
+                        # Имя CTE видно только после его тела: внутри тела
+                        # (и в более ранних CTE) это имя — настоящая таблица
+                        ctes.add(pending_cte)
+                        pending_cte = None
+                elif value == ',' and depth in from_depths:
+                    expect_table = True
+
+            elif kind == 'ident':
+                if value in FORBIDDEN:
+                    return f"запрещенное ключевое слово: {value}"
+                if value == 'select':
+                    selects[-1] = True
+                elif value == 'from' and selects[-1] or value == 'join':
+                    from_depths.add(depth)
+                    expect_table = True
+                elif value in _FROM_END:
+                    from_depths.discard(depth)
+                if next_token == ('op', '('):
+                    if value not in FUNCTIONS and value not in KEYWORDS:
+                        return f"функция не разрешена: {value}"
+                elif prev == 'as' or prev in self.tables or prev in ctes or prev == ')' and prev_kind == 'op':
+                    # Псевдоним: после AS, после имени таблицы или после подзапроса
+                    if value not in KEYWORDS:
+                        aliases.add(value)
+                elif prev == '::':
+                    if value not in KEYWORDS:
+                        return f"недопустимый тип: {value}"
+                elif (
+                    prev in ('with', ',') and next_token == ('ident', 'as')
+                    and i + 2 < len(tokens) and tokens[i + 2] == ('op', '(')
+                ):
+                    # Имя CTE: WITH name AS (...). Имена из вложенных WITH
+                    # в список источников не попадают: ссылку на них
+                    # нельзя отличить от одноименной таблицы вне подзапроса
+                    if depth == 0:
+                        pending_cte = value
+                elif prev == '.' and prev_kind == 'op':
+                    if value not in self.columns:
+                        return f"неизвестная колонка: {value}"
+                elif value not in KEYWORDS:
+                    used.append(value)
+
+            prev_kind, prev = kind, value
+
+        if depth != 0:
+            return "несбалансированные скобки"
+
+        for name in used:
+            if name not in self.tables and name not in self.columns and name not in aliases and name not in ctes:
+                return f"неизвестный идентификатор: {name}"
+
+        return None
@@ -0,0 +1,126 @@
+import time
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    # Состояние в памяти процесса: подходит для одного экземпляра бота
+    shared = False
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._data = {}
+
+    def _alive(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def _store(self, key: str, value, ttl: Optional[float]):
+        if len(self._data) >= self.max_keys and key not in self._data:
+            self._purge()
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def _purge(self):
+        now = time.monotonic()
+        for key in [k for k, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+            del self._data[key]
+        while len(self._data) >= self.max_keys:
+            del self._data[next(iter(self._data))]
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._alive(key)
+        return None if item is None else item[0]
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._store(key, value, ttl)
+
+    async def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if self._alive(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    async def incr(self, key: str, ttl: float) -> int:
+        item = self._alive(key)
+        if item is None:
+            self._store(key, 1, ttl)
+            return 1
+        value, expires_at = item
+        self._data[key] = (value + 1, expires_at)
+        return value + 1
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def delete_if_equals(self, key: str, value: str) -> bool:
+        item = self._alive(key)
+        if item is None or item[0] != value:
+            return False
+        del self._data[key]
+        return True
+
+    async def close(self):
+        self._data.clear()
+
+
+# Проверка и удаление одной командой: между GET и DEL ключ мог истечь
+# и достаться другому процессу
+_DELETE_IF_EQUALS_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBackend:
+    # Общее состояние для нескольких процессов или узлов: Redis или
+    # совместимый с ним сервер (KeyDB, Dragonfly, Valkey)
+    shared = True
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("Для REDIS_URL нужен пакет redis: pip install redis") from e
+
+        self._redis = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._redis.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return bool(await self._redis.set(key, value, px=int(ttl * 1000) if ttl else None, nx=True))
+
+    async def incr(self, key: str, ttl: float) -> int:
+        count = await self._redis.incr(key)
+        if count == 1:
+            await self._redis.expire(key, int(ttl))
+        return count
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    async def delete_if_equals(self, key: str, value: str) -> bool:
+        return bool(await self._redis.eval(_DELETE_IF_EQUALS_LUA, 1, key, value))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_backend(redis_url: Optional[str] = None):
+    if redis_url:
+        logger.info("Общее состояние хранится в Redis")
+        return RedisBackend(redis_url)
+    return MemoryBackend()
@@ -0,0 +1,265 @@
+import re
+import time
+import uuid
+import weakref
+import logging
+from collections import OrderedDict
+from datetime import date, datetime, tzinfo
+from decimal import Decimal
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy.ext.asyncio import AsyncSession
+from SqlValidator import tokenize
+
+logger = logging.getLogger(__name__)
+
+# После этих слов строка — часть записи типа (DATE '...', INTERVAL '...'),
+# вместо нее параметр подставить нельзя
+_TYPED_LITERALS = frozenset(('date', 'time', 'timestamp', 'timestamptz', 'interval', 'uuid'))
+# Конец списка ORDER BY / GROUP BY: числа в нем — номера столбцов, а не значения
+_CLAUSE_END = frozenset(('limit', 'offset', 'having', 'where', 'from', 'select', 'union', 'except', 'intersect', 'window', 'fetch'))
+_NAMED_PARAM_RE = re.compile(r'(?<!:):([a-zA-Z_]\w*)')
+_TZ_SUFFIX_RE = re.compile(r'([+-]\d{2})$')
+
+
+def parameterize(query: str) -> Optional[tuple]:
+    # Строковые и числовые литералы выносятся в параметры $1, $2, ...:
+    # вопросы одного вида дают одинаковый текст запроса и один план
+    tokens = tokenize(query.strip().rstrip(';'))
+    if tokens is None:
+        return None
+
+    parts = []
+    literals = []
+    prev = None
+    in_by = False
+    for kind, value in tokens:
+        lowered = value.lower()
+        if kind == 'string' and prev not in _TYPED_LITERALS:
+            literals.append(('string', value[1:-1].replace("''", "'")))
+            parts.append(f"${len(literals)}")
+        elif kind == 'number' and not in_by:
+            literals.append(('number', value))
+            parts.append(f"${len(literals)}")
+        elif kind in ('line_comment', 'block_comment'):
+            parts.append(' ')
+            continue
+        else:
+            parts.append(value)
+
+        if kind == 'ws':
+            continue
+        if kind == 'ident' and lowered == 'by' and prev in ('order', 'group'):
+            in_by = True
+        elif (kind == 'ident' and lowered in _CLAUSE_END) or value == ')':
+            in_by = False
+        prev = lowered
+
+    return ''.join(parts), literals
+
+
+def strip_comments(query: str) -> str:
+    tokens = tokenize(query)
+    if tokens is None:
+        return query
+    return ''.join(' ' if kind in ('line_comment', 'block_comment') else value for kind, value in tokens)
+
+
+def combine_queries(queries: list) -> tuple:
+    # Скалярные запросы объединяются в один SELECT (q1), (q2), ...:
+    # N ответов за одно обращение к БД. Именованные параметры каждого
+    # подзапроса получают свой префикс, чтобы не пересекаться. Комментарии
+    # убираются, а скобки стоят на отдельных строках: "-- ..." в конце
+    # подзапроса не закомментирует закрывающую скобку
+    columns = []
+    combined_params = {}
+    for i, (query, params) in enumerate(queries):
+        prefix = f"q{i}_"
+        query = strip_comments(query).strip().rstrip(';').strip()
+        if params:
+            query = _NAMED_PARAM_RE.sub(lambda m: f":{prefix}{m[1]}", query)
+            combined_params.update({prefix + name: value for name, value in params.items()})
+        columns.append(f"(\n{query}\n)")
+    return "SELECT\n" + ",\n".join(columns), combined_params
+
+
+def _parse_timestamp(value: str) -> datetime:
+    value = _TZ_SUFFIX_RE.sub(r'\1:00', value.strip().replace('Z', '+00:00'))
+    return datetime.fromisoformat(value)
+
+
+@lru_cache(maxsize=16)
+def session_zone(name: Optional[str]) -> Optional[tzinfo]:
+    # Зона сессии PostgreSQL (параметр TimeZone) как tzinfo; None — если
+    # ее нет или Python ее не знает (например, POSIX-запись вида <+03>-03)
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ValueError, KeyError):
+        return None
+
+
+def convert_literal(type_name: str, kind: str, value: str, zone: Optional[tzinfo] = None):
+    # Текст литерала приводится к типу, который PostgreSQL вывел для параметра.
+    # Для неподдержанных типов ValueError: запрос выполнится без подготовки
+    if type_name in ('text', 'varchar', 'bpchar', 'name'):
+        return value
+    if type_name in ('int2', 'int4', 'int8'):
+        return int(value)
+    if type_name == 'numeric':
+        return Decimal(value)
+    if type_name in ('float4', 'float8'):
+        return float(value)
+    if kind != 'string':
+        raise ValueError(f"число в параметре типа {type_name}")
+    if type_name == 'date':
+        return date.fromisoformat(value.strip())
+    if type_name == 'timestamptz':
+        # Литерал без зоны PostgreSQL читает в зоне сессии: так же делаем и
+        # здесь, а если зона неизвестна — запрос выполнится через text()
+        parsed = _parse_timestamp(value)
+        if parsed.tzinfo is not None:
+            return parsed
+        if zone is None:
+            raise ValueError("время без зоны при неизвестной зоне сессии")
+        return parsed.replace(tzinfo=zone)
+    if type_name == 'timestamp':
+        # Как и PostgreSQL, смещение у timestamp без зоны отбрасываем
+        return _parse_timestamp(value).replace(tzinfo=None)
+    if type_name == 'uuid':
+        return uuid.UUID(value)
+    if type_name == 'bool' and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    raise ValueError(f"тип параметра {type_name}")
+
+
+class ShapeStats:
+    __slots__ = ('hits', 'misses', 'prepare_seconds')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.prepare_seconds = 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        # Попадание экономит разбор и анализ запроса в PostgreSQL: оцениваем
+        # его средним временем подготовки этого вида запроса
+        return self.hits * self.prepare_seconds / self.misses if self.misses else 0.0
+
+
+class StatementCache:
+    # Подготовленные операторы по нормализованному виду запроса отдельно на
+    # каждом соединении пула (LRU на max_statements); соединение, закрытое
+    # пулом, уходит из кеша вместе со своими операторами
+    def __init__(self, max_statements: int = 100, max_shapes: int = 1000):
+        self.max_statements = max_statements
+        self.max_shapes = max_shapes
+        self.fallbacks = 0
+        self._statements = weakref.WeakKeyDictionary()
+        self._shapes: OrderedDict = OrderedDict()
+
+    def _shape_stats(self, shape: str) -> ShapeStats:
+        stats = self._shapes.get(shape)
+        if stats is None:
+            stats = self._shapes[shape] = ShapeStats()
+            while len(self._shapes) > self.max_shapes:
+                self._shapes.popitem(last=False)
+        else:
+            self._shapes.move_to_end(shape)
+        return stats
+
+    @staticmethod
+    def _shape(query: str, params: Optional[dict]) -> Optional[tuple]:
+        if not params:
+            return parameterize(query)
+
+        # Запрос из шаблона уже с именованными параметрами нужных типов
+        order = []
+
+        def placeholder(m):
+            if m[1] not in order:
+                order.append(m[1])
+            return f"${order.index(m[1]) + 1}"
+
+        shape = _NAMED_PARAM_RE.sub(placeholder, query.strip().rstrip(';'))
+        if any(name not in params for name in order):
+            return None
+        return shape, [('value', params[name]) for name in order]
+
+    async def _prepare(self, conn, shape: str, stats: ShapeStats):
+        statements = self._statements.get(conn)
+        if statements is None:
+            statements = self._statements[conn] = OrderedDict()
+
+        statement = statements.get(shape)
+        if statement is not None:
+            statements.move_to_end(shape)
+            stats.hits += 1
+            return statement
+
+        started = time.perf_counter()
+        # Ошибка разбора внутри транзакции сессии откатывает только точку сохранения
+        async with conn.transaction():
+            statement = await conn.prepare(shape)
+        stats.prepare_seconds += time.perf_counter() - started
+        stats.misses += 1
+
+        statements[shape] = statement
+        while len(statements) > self.max_statements:
+            statements.popitem(last=False)
+        return statement
+
+    async def fetchval(self, session: AsyncSession, query: str, params: Optional[dict] = None) -> tuple:
+        # Возвращает (True, значение) или (False, None), если запрос надо
+        # выполнить обычным путем через text()
+        shaped = self._shape(query, params)
+        if shaped is None:
+            self.fallbacks += 1
+            return False, None
+        shape, literals = shaped
+
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        conn = raw.driver_connection
+        stats = self._shape_stats(shape)
+        zone = session_zone(getattr(conn.get_settings(), 'TimeZone', None))
+
+        try:
+            statement = await self._prepare(conn, shape, stats)
+            args = [
+                value if kind == 'value' else convert_literal(parameter.name, kind, value, zone)
+                for (kind, value), parameter in zip(literals, statement.get_parameters())
+            ]
+        except Exception as e:
+            logger.info(f"Запрос выполняется без подготовки ({e}): {shape[:200]}")
+            self.fallbacks += 1
+            return False, None
+
+        return True, await statement.fetchval(*args)
+
+    def stats(self) -> dict:
+        hits = sum(stats.hits for stats in self._shapes.values())
+        misses = sum(stats.misses for stats in self._shapes.values())
+        return {
+            "shapes": len(self._shapes),
+            "connections": len(self._statements),
+            "hits": hits,
+            "misses": misses,
+            "fallbacks": self.fallbacks,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "saved_seconds": sum(stats.saved_seconds for stats in self._shapes.values()),
+        }
+
+    def report(self, limit: int = 10) -> str:
+        top = sorted(self._shapes.items(), key=lambda item: item[1].hits, reverse=True)[:limit]
+        lines = ["Подготовленные запросы (попадания / подготовки, доля, сэкономлено мс):"]
+        for shape, stats in top:
+            total = stats.hits + stats.misses
+            lines.append(
+                f"{stats.hits} / {stats.misses}, {stats.hits / total if total else 0.0:.2f}, "
+                f"{stats.saved_seconds * 1000:.1f}: {' '.join(shape.split())[:120]}"
+            )
+        return "\n".join(lines)
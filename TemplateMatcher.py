@@ -0,0 +1,182 @@
+import re
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from QueryCache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+METRICS = {
+    'просмотр': 'views',
+    'лайк': 'likes',
+    'комментари': 'comments',
+    'жалоб': 'reports',
+}
+
+_ISO = r'\d{4}-\d{2}-\d{2}'
+_PERIOD = rf'(?P<period>с {_ISO} по {_ISO}|{_ISO})(?: включительно)?'
+_METRIC = r'(?P<metric>просмотр\w*|лайк\w*|комментари\w*|жалоб\w*)'
+_PERIOD_RE = re.compile(rf'(?:с ({_ISO}) по ({_ISO})|({_ISO}))', re.IGNORECASE)
+
+
+def _day_start(value: str) -> datetime:
+    return datetime.combine(date.fromisoformat(value), datetime.min.time(), tzinfo=timezone.utc)
+
+
+def parse_period(period: str) -> tuple:
+    # "с A по B" считаем включительно: верхняя граница — начало дня после B
+    match = _PERIOD_RE.fullmatch(period)
+    if match[3]:
+        start = _day_start(match[3])
+        return start, start + timedelta(days=1)
+    return _day_start(match[1]), _day_start(match[2]) + timedelta(days=1)
+
+
+def _metric_column(word: str) -> str:
+    word = word.lower()
+    for prefix, metric in METRICS.items():
+        if word.startswith(prefix):
+            return metric
+    raise ValueError(f"Неизвестная метрика: {word}")
+
+
+def _total_videos(m) -> tuple:
+    return "SELECT COUNT(*) FROM videos", {}
+
+
+def _creator_videos(m) -> tuple:
+    params = {"creator_id": m['creator']}
+    sql = "SELECT COUNT(*) FROM videos WHERE creator_id = :creator_id"
+    if m['period']:
+        params["start"], params["end"] = parse_period(m['period'])
+        sql += " AND video_created_at >= :start AND video_created_at < :end"
+    return sql, params
+
+
+def _videos_published(m) -> tuple:
+    start, end = parse_period(m['period'])
+    sql = "SELECT COUNT(*) FROM videos WHERE video_created_at >= :start AND video_created_at < :end"
+    return sql, {"start": start, "end": end}
+
+
+def _videos_above(m) -> tuple:
+    column = f"{_metric_column(m['metric'])}_count"
+    params = {"threshold": int(m['threshold'].replace(' ', ''))}
+    sql = f"SELECT COUNT(*) FROM videos WHERE {column} > :threshold"
+    if m['creator']:
+        params["creator_id"] = m['creator']
+        sql += " AND creator_id = :creator_id"
+    return sql, params
+
+
+def _metric_growth(m) -> tuple:
+    column = f"delta_{_metric_column(m['metric'])}_count"
+    start, end = parse_period(m['period'])
+    sql = (
+        f"SELECT COALESCE(SUM({column}), 0) FROM video_snapshots "
+        "WHERE created_at >= :start AND created_at < :end"
+    )
+    return sql, {"start": start, "end": end}
+
+
+def _videos_with_growth(m) -> tuple:
+    column = f"delta_{_metric_column(m['metric'])}_count"
+    start, end = parse_period(m['period'])
+    sql = (
+        f"SELECT COUNT(DISTINCT video_id) FROM video_snapshots "
+        f"WHERE {column} > 0 AND created_at >= :start AND created_at < :end"
+    )
+    return sql, {"start": start, "end": end}
+
+
+_CREATOR = r'(?:у )?креатора (?:с id )?(?P<creator>[0-9a-z_-]+)'
+
+TEMPLATES = (
+    (
+        'total_videos',
+        re.compile(r'сколько (?:всего )?видео(?: всего)?(?: есть)?(?: в (?:системе|базе))?', re.IGNORECASE),
+        _total_videos
+    ),
+    (
+        'creator_videos',
+        re.compile(
+            rf'сколько (?:всего )?видео {_CREATOR}'
+            rf'(?: (?:вышло|опубликовано|было опубликовано))?(?: (?:(?:за|в) период )?{_PERIOD})?',
+            re.IGNORECASE
+        ),
+        _creator_videos
+    ),
+    (
+        'videos_published',
+        re.compile(rf'сколько (?:всего )?видео (?:вышло|опубликовано|было опубликовано) (?:(?:за период|в период) )?{_PERIOD}', re.IGNORECASE),
+        _videos_published
+    ),
+    (
+        'videos_above',
+        re.compile(
+            rf'сколько видео(?: {_CREATOR})? (?:набрало|набрали|имеют|имеет) (?:больше|более) '
+            rf'(?P<threshold>\d[\d ]*) {_METRIC}(?: за все время)?',
+            re.IGNORECASE
+        ),
+        _videos_above
+    ),
+    (
+        'metric_growth',
+        re.compile(
+            rf'на сколько (?:в сумме |всего )?(?:выросли|увеличились|выросло|выросло количество) (?:все )?{_METRIC}'
+            rf'(?: (?:у )?всех видео)? (?:за |в )?{_PERIOD}',
+            re.IGNORECASE
+        ),
+        _metric_growth
+    ),
+    (
+        'metric_growth',
+        re.compile(
+            rf'на сколько {_METRIC} (?:в сумме |всего )?(?:выросли|выросло|набрали) (?:все )?видео'
+            rf' (?:за |в )?{_PERIOD}',
+            re.IGNORECASE
+        ),
+        _metric_growth
+    ),
+    (
+        'videos_with_growth',
+        re.compile(rf'сколько (?:разных )?видео получал[иа]? новые {_METRIC} (?:за |в )?{_PERIOD}', re.IGNORECASE),
+        _videos_with_growth
+    ),
+)
+
+
+class TemplateMatcher:
+    def __init__(self):
+        self.total = 0
+        self.matched = Counter()
+
+    def match(self, user_query: str) -> Optional[tuple]:
+        self.total += 1
+        # Регистр не влияет на выбор шаблона, но сохраняется в параметрах:
+        # id креатора может содержать заглавные буквы
+        question = normalize_question(user_query, keep_case=True)
+
+        for name, pattern, build in TEMPLATES:
+            m = pattern.fullmatch(question)
+            if m is None:
+                continue
+            try:
+                sql, params = build(m)
+            except ValueError as e:
+                logger.warning(f"Шаблон {name} не применим к запросу '{user_query}': {e}")
+                return None
+            self.matched[name] += 1
+            return sql, params
+
+        return None
+
+    def stats(self) -> dict:
+        served = sum(self.matched.values())
+        return {
+            "total": self.total,
+            "served": served,
+            "fast_path_rate": served / self.total if self.total else 0.0,
+            "by_template": dict(self.matched),
+        }
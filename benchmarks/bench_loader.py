@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database'))
+
+import database
+from generate_dataset import write_dataset
+
+
+async def run_mode(mode: str, json_path: str, workers: int):
+    engine = await database.drop_and_create_tables()
+    await engine.dispose()
+
+    started = time.perf_counter()
+    if mode == 'orm':
+        await database.load_json_to_db(json_path)
+    elif mode == 'copy':
+        await database.load_json_to_db_copy(json_path)
+    elif mode == 'parallel':
+        await database.load_json_to_db_parallel(json_path, workers=workers)
+    else:
+        raise ValueError(f"Неизвестный режим: {mode}")
+    return time.perf_counter() - started
+
+
+async def run(args):
+    json_path = args.json
+    if json_path is None:
+        json_path = os.path.join(tempfile.mkdtemp(), 'videos.json')
+        write_dataset(json_path, args.videos, args.snapshots, args.creators)
+
+    size_mb = os.path.getsize(json_path) / 1024 / 1024
+    rows = args.videos * (1 + args.snapshots) if args.json is None else None
+
+    results = []
+    for mode in args.modes.split(','):
+        elapsed = await run_mode(mode, json_path, args.workers)
+        results.append((mode, elapsed))
+
+    print(f"Файл: {json_path} ({size_mb:.1f} МБ)")
+    print(f"{'режим':<10} {'время, с':>10} {'строк/с':>12} {'МБ/с':>8}")
+    for mode, elapsed in results:
+        rate = f"{rows / elapsed:.0f}" if rows else "-"
+        print(f"{mode:<10} {elapsed:>10.2f} {rate:>12} {size_mb / elapsed:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение режимов загрузки JSON в БД")
+    parser.add_argument("--json", help="готовый JSON-файл (по умолчанию генерируется синтетический)")
+    parser.add_argument("--videos", type=int, default=10000)
+    parser.add_argument("--snapshots", type=int, default=48)
+    parser.add_argument("--creators", type=int, default=100)
+    parser.add_argument("--modes", default="copy,parallel,orm", help="режимы через запятую: orm, copy, parallel")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SqlValidator import SqlValidator
+from database.models import Base, SERVICE_TABLES, rollups_metadata
+
+
+def is_safe_sql_regex(query: str) -> bool:
+    # Прежняя реализация из bot.py, оставлена для сравнения
+    query_lower = query.strip().lower()
+    if not query_lower.startswith('select'):
+        return False
+
+    query_clean = re.sub(r'--.*?\n|/\*.*?\*/', '', query_lower, flags=re.DOTALL)
+
+    statements = [s.strip() for s in query_clean.split(';') if s.strip()]
+    if len(statements) != 1:
+        return False
+
+    statement = statements[0]
+    if not statement.startswith('select'):
+        return False
+
+    dangerous_keywords = [
+        r'\binsert\b', r'\bupdate\b', r'\bdelete\b',
+        r'\bdrop\b', r'\btruncate\b', r'\bcreate\b',
+        r'\balter\b', r'\bgrant\b', r'\brevoke\b',
+        r'\bexec(ute)?\b', r'\bunion\b',
+        r'information_schema\b', r'pg_',
+        r'\bcurrent_user\b', r'\bsession_user\b',
+        r'\binto\b\s+(\w+\.)?\w*\s*(\(|values)',
+    ]
+
+    for pattern in dangerous_keywords:
+        if re.search(pattern, statement, re.IGNORECASE):
+            return False
+
+    return True
+
+
+QUERIES = {
+    'short': "SELECT COUNT(*) FROM videos",
+    'join': (
+        "SELECT SUM(s.delta_views_count) FROM video_snapshots s "
+        "JOIN videos v ON v.id = s.video_id "
+        "WHERE v.creator_id = 'aca1061a9d324ecf8c3fa2bb32d7be63' "
+        "AND s.created_at >= '2025-11-28 10:00:00+00' AND s.created_at < '2025-11-28 15:00:00+00'"
+    ),
+    'long': (
+        "-- Считаем видео креатора, у которых просмотры росли в каждом из выбранных часов\n"
+        "SELECT COUNT(DISTINCT v.id) FROM videos v\n"
+        "JOIN video_snapshots s ON s.video_id = v.id\n"
+        "WHERE v.creator_id = 'aca1061a9d324ecf8c3fa2bb32d7be63'\n"
+        + "\n".join(
+            f"  /* час {h} */ AND NOT (s.created_at >= '2025-11-28 {h:02d}:00:00+00' "
+            f"AND s.created_at < '2025-11-28 {h:02d}:30:00+00' AND s.delta_views_count <= 0)"
+            for h in range(24)
+        )
+    ),
+}
+
+
+def main():
+    validator = SqlValidator.from_metadata(Base.metadata, rollups_metadata, exclude=SERVICE_TABLES)
+    number = 2000
+
+    print(
+        f"{'запрос':<8} {'длина':>6} {'regex, мкс':>12} {'токенизатор, мкс':>18} {'с кешем, мкс':>14}"
+        f" {'regex':>7} {'токенизатор':>12}"
+    )
+    for name, query in QUERIES.items():
+        regex_time = timeit.timeit(lambda: is_safe_sql_regex(query), number=number) / number * 1e6
+        tokenizer_time = timeit.timeit(lambda: validator._check(query), number=number) / number * 1e6
+        cached_time = timeit.timeit(lambda: validator.check(query), number=number) / number * 1e6
+        print(
+            f"{name:<8} {len(query):>6} {regex_time:>12.1f} {tokenizer_time:>18.1f} {cached_time:>14.2f}"
+            f" {str(is_safe_sql_regex(query)):>7} {str(validator.check(query) is None):>12}"
+        )
+
+    literal_query = "SELECT COUNT(*) FROM videos WHERE creator_id = 'pg_demo'"
+    print()
+    print(f"Литерал с pg_: regex={is_safe_sql_regex(literal_query)}, токенизатор={validator.check(literal_query) is None}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import json
+import random
+from aiohttp import web
+
+DEFAULT_SQL = "SELECT COUNT(*) FROM videos"
+
+
+class FakeLlm:
+    # Заглушка OpenRouter chat/completions: отвечает фиксированным SQL
+    # с настраиваемой задержкой, чтобы мерить бота без внешнего API
+    def __init__(self, latency: float, jitter: float, error_rate: float, sql: str):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.sql = sql
+        self.requests = 0
+
+    async def delay(self):
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    async def stream_completion(self, request: web.Request, payload: dict, content: str, prompt_tokens: int) -> web.StreamResponse:
+        # Ответ по кусочкам в формате SSE, как у OpenRouter при stream: true;
+        # после SQL идет пояснение, которое клиент может не дочитывать
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+
+        content += "\nЗапрос считает нужное значение по таблице videos."
+        pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+        for piece in pieces:
+            await asyncio.sleep(self.latency / len(pieces))
+            event = {"id": f"fake-{self.requests}", "model": payload.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": piece}}]}
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                 "total_tokens": prompt_tokens + len(content) // 4}
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode('utf-8'))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        if not payload.get("stream"):
+            await self.delay()
+
+        if random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "rate limited"}}, status=429)
+
+        prompt_tokens = sum(len(message["content"]) for message in payload.get("messages", [])) // 4
+        content = f"```sql\n{self.sql}\n```"
+        if payload.get("stream"):
+            return await self.stream_completion(request, payload, content, prompt_tokens)
+        return web.json_response({
+            "id": f"fake-{self.requests}",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4,
+            },
+        })
+
+
+def create_app(latency: float = 0.5, jitter: float = 0.1, error_rate: float = 0.0, sql: str = DEFAULT_SQL) -> web.Application:
+    llm = FakeLlm(latency, jitter, error_rate, sql)
+    app = web.Application()
+    app["llm"] = llm
+    app.router.add_post("/api/v1/chat/completions", llm.chat_completions)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка OpenRouter chat/completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="средняя задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.1, help="стандартное отклонение задержки, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой 429")
+    parser.add_argument("--sql", default=DEFAULT_SQL, help="SQL, который возвращает заглушка")
+    args = parser.parse_args()
+
+    print(f"OPENROUTER_BASE_URL=http://{args.host}:{args.port}/api/v1/chat/completions")
+    web.run_app(create_app(args.latency, args.jitter, args.error_rate, args.sql), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+def iso(value: datetime) -> str:
+    return value.isoformat().replace('+00:00', 'Z')
+
+
+def generate_video(rng: random.Random, creators: list, start: datetime, snapshots: int, snapshot_seq: list) -> dict:
+    video_created_at = start + timedelta(minutes=rng.randrange(0, 60 * 24 * 30))
+    first_snapshot_at = video_created_at.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+    counts = {'views': 0, 'likes': 0, 'comments': 0, 'reports': 0}
+    video_snapshots = []
+    for hour in range(snapshots):
+        deltas = {
+            'views': rng.randrange(0, 500),
+            'likes': rng.randrange(0, 50),
+            'comments': rng.randrange(0, 10),
+            'reports': 1 if rng.random() < 0.01 else 0,
+        }
+        for metric, delta in deltas.items():
+            counts[metric] += delta
+
+        created_at = first_snapshot_at + timedelta(hours=hour)
+        snapshot_seq[0] += 1
+        video_snapshots.append({
+            'id': f"{snapshot_seq[0]:032x}",
+            'views_count': counts['views'],
+            'likes_count': counts['likes'],
+            'comments_count': counts['comments'],
+            'reports_count': counts['reports'],
+            'delta_views_count': deltas['views'],
+            'delta_likes_count': deltas['likes'],
+            'delta_comments_count': deltas['comments'],
+            'delta_reports_count': deltas['reports'],
+            'created_at': iso(created_at),
+            'updated_at': iso(created_at),
+        })
+
+    updated_at = first_snapshot_at + timedelta(hours=max(snapshots - 1, 0))
+    return {
+        'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'creator_id': rng.choice(creators),
+        'video_created_at': iso(video_created_at),
+        'views_count': counts['views'],
+        'likes_count': counts['likes'],
+        'comments_count': counts['comments'],
+        'reports_count': counts['reports'],
+        'created_at': iso(video_created_at),
+        'updated_at': iso(updated_at),
+        'snapshots': video_snapshots,
+    }
+
+
+def write_dataset(path: str, videos: int, snapshots: int, creators: int, seed: int = 42):
+    # Файл пишется по одному видео, поэтому размер датасета не ограничен памятью
+    rng = random.Random(seed)
+    creator_ids = [f"{rng.getrandbits(128):032x}" for _ in range(creators)]
+    start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+    snapshot_seq = [0]
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"videos": [\n')
+        for i in range(videos):
+            if i:
+                f.write(',\n')
+            json.dump(generate_video(rng, creator_ids, start, snapshots, snapshot_seq), f, ensure_ascii=False)
+        f.write('\n]}\n')
+
+    return videos * (1 + snapshots)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетического JSON-дампа видео и снапшотов")
+    parser.add_argument("output", help="путь к создаваемому JSON-файлу")
+    parser.add_argument("--videos", type=int, default=10000, help="число видео (по умолчанию 10000)")
+    parser.add_argument("--snapshots", type=int, default=48, help="снапшотов на видео (по умолчанию 48)")
+    parser.add_argument("--creators", type=int, default=100, help="число креаторов (по умолчанию 100)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rows = write_dataset(args.output, args.videos, args.snapshots, args.creators, args.seed)
+    print(f"Создан {args.output}: {args.videos} видео, {rows - args.videos} снапшотов")
+
+
+if __name__ == "__main__":
+    main()
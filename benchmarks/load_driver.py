@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+from aiohttp import web
+
+from Metrics import Histogram
+from fake_llm_server import create_app
+
+QUESTIONS = [
+    "Сколько всего видео есть в системе?",
+    "Сколько видео вышло 5 ноября 2025?",
+    "На сколько выросли просмотры 10 ноября 2025?",
+    "Сколько разных видео получали новые просмотры 12 ноября 2025?",
+    "Сколько видео набрало больше 10 000 просмотров?",
+    "Какой креатор набрал больше всего лайков за ноябрь 2025?",
+    "Сколько видео имеют хотя бы одну жалобу?",
+    "Какое среднее число комментариев у видео, опубликованных в первую неделю ноября 2025?",
+]
+
+
+class FakeTelegramSession(BaseSession):
+    # Вместо Bot API ответы бота просто считаются
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        return
+        yield
+
+    async def make_request(self, bot, method, timeout=None):
+        self.sent += 1
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=self.sent,
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text
+            )
+        return True
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="bench"),
+            text=text
+        )
+    )
+
+
+async def run(args):
+    llm_runner = web.AppRunner(create_app(latency=args.llm_latency, jitter=args.llm_jitter))
+    await llm_runner.setup()
+    await web.TCPSite(llm_runner, host="127.0.0.1", port=args.llm_port).start()
+
+    # bot.py читает настройки при импорте, поэтому импортируем после подготовки окружения
+    import bot as bot_module
+
+    session = FakeTelegramSession()
+    bot_module.bot.session = session
+    await bot_module.startup()
+
+    latency = Histogram()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(i: int):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        if args.unique:
+            question = f"{question} #{i}"
+        update = make_update(i + 1, i % args.users + 1, question)
+        async with semaphore:
+            started = time.perf_counter()
+            await bot_module.dp.feed_update(bot_module.bot, update)
+            latency.record(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(send(i) for i in range(args.requests)))
+    finally:
+        elapsed = time.perf_counter() - started
+        print(f"Запросов: {args.requests}, ответов: {session.sent}, время {elapsed:.2f} с")
+        print(f"QPS: {args.requests / elapsed:.1f}")
+        print(
+            "Задержка, мс: "
+            + ", ".join(f"p{p}={latency.percentile(p) * 1000:.1f}" for p in (50, 95, 99))
+            + f", max={latency.max * 1000:.1f}"
+        )
+        print()
+        print(bot_module.metrics.render_text())
+
+        await bot_module.shutdown()
+        await llm_runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на синтетических обновлениях Telegram")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--unique", action="store_true", help="делать вопросы уникальными (без попаданий в кеши)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="средняя задержка заглушки LLM, с")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--llm-port", type=int, default=8089)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:benchmark-token")
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    os.environ.setdefault("QUERY_CACHE_PATH", "")
+    os.environ["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}/api/v1/chat/completions"
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,45 +2,192 @@ import asyncio
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters.command import Command
 from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from SqlQueryGenerator import SqlQueryGenerator
+from SqlQueryGenerator import SqlQueryGenerator, parse_backends
+from QueryCache import QueryCache, normalize_question
+from ResultCache import ResultCache
+from TemplateMatcher import TemplateMatcher
+from SqlValidator import SqlValidator
+from RequestScheduler import RequestScheduler, RequestSuperseded
+from Metrics import Metrics
+from QueryGuard import QueryGuard, is_statement_timeout
+from StateBackend import create_backend
+from ColumnarReplica import ColumnarReplica
+from StatementCache import StatementCache, combine_queries
+from database.models import Base, SERVICE_TABLES, rollups_metadata
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
-import sys
 import re
+import sys
+import time
+import uuid
+import multiprocessing
+import queue
 import logging
+from typing import Optional
+from logging.handlers import QueueHandler, QueueListener
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Запись в файл идет в отдельном потоке QueueListener, чтобы диск
+# не блокировал цикл событий бота
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.FileHandler('bot.log', encoding='utf-8'),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+log_listener.start()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
 DATABASE_URL = os.getenv("DATABASE_URL")
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "query_cache.sqlite3")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1000"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", str(24 * 3600)))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_CONNECTION_LIMIT = int(os.getenv("LLM_CONNECTION_LIMIT", "16"))
+LLM_STREAM = os.getenv("LLM_STREAM", "0") == "1"
+LLM_COMPACT_PROMPT = os.getenv("LLM_COMPACT_PROMPT", "0") == "1"
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "10"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "10"))
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "16"))
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "10000"))
+QUERY_MAX_COST = float(os.getenv("QUERY_MAX_COST", "5000000"))
+REDIS_URL = os.getenv("REDIS_URL")
+RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))
+SHARED_RESULT_TTL = int(os.getenv("SHARED_RESULT_TTL", "3600"))
+COLUMNAR_REPLICA = os.getenv("COLUMNAR_REPLICA", "0") == "1"
+REPLICA_REFRESH_INTERVAL = float(os.getenv("REPLICA_REFRESH_INTERVAL", "5"))
+PREPARED_STATEMENTS = int(os.getenv("PREPARED_STATEMENTS", "100"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Номер процесса webhook, задается родителем при запуске нескольких процессов
+WEB_WORKER_INDEX = int(os.getenv("WEB_WORKER_INDEX", "0"))
 
 if not all([TELEGRAM_TOKEN, OPENROUTER_API_KEY, DATABASE_URL]):
     logger.error("Не все переменные окружения установлены")
+    log_listener.stop()
     sys.exit(1)
 
 bot = Bot(token=TELEGRAM_TOKEN)
 
 dp = Dispatcher()
 
+def worker_path(path: str) -> str:
+    # SQLite-файл у каждого процесса webhook свой: общий файл под нагрузкой
+    # дает блокировки ("database is locked"), общий кеш обеспечивает Redis
+    if not path or WEB_WORKERS <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{WEB_WORKER_INDEX}{ext}"
+
+
+query_cache = QueryCache(
+    max_size=QUERY_CACHE_SIZE,
+    ttl=QUERY_CACHE_TTL,
+    path=worker_path(QUERY_CACHE_PATH) or None
+)
+
+result_cache = ResultCache(max_size=RESULT_CACHE_SIZE)
+
+template_matcher = TemplateMatcher()
+
+sql_validator = SqlValidator.from_metadata(Base.metadata, rollups_metadata, exclude=SERVICE_TABLES)
+
+query_guard = QueryGuard(max_cost=QUERY_MAX_COST)
+
+# Колоночная копия данных в памяти (нужен numpy): типовые агрегаты
+# считаются без обращения к PostgreSQL
+replica = ColumnarReplica() if COLUMNAR_REPLICA else None
+replica_task = None
+
+# Литералы SQL выносятся в параметры, подготовленные операторы хранятся
+# на каждом соединении пула: одинаковые по виду вопросы не планируются заново
+statement_cache = StatementCache(max_statements=PREPARED_STATEMENTS) if PREPARED_STATEMENTS else None
+
+# Кеши, лимиты и признак "запрос уже выполняется" общие для всех
+# процессов бота, если задан REDIS_URL; иначе живут в памяти процесса
+state = create_backend(REDIS_URL)
+
+metrics = Metrics()
+
+scheduler = RequestScheduler(
+    workers=SCHEDULER_WORKERS,
+    db_limit=DB_MAX_CONCURRENCY,
+    metrics=metrics
+)
+
+metrics.register_stats(
+    "llm",
+    lambda: dict(generator.usage, coalesced=generator.coalesced, hedged=generator.hedged, fallback_wins=generator.fallback_wins)
+)
+metrics.register_stats("scheduler", scheduler.stats)
+metrics.register_stats("templates", template_matcher.stats)
+metrics.register_stats("query_cache", query_cache.stats)
+metrics.register_stats("result_cache", result_cache.stats)
+metrics.register_stats("query_guard", query_guard.stats)
+if replica is not None:
+    metrics.register_stats("replica", replica.stats)
+if statement_cache is not None:
+    metrics.register_stats("prepared", statement_cache.stats)
+
+generator = SqlQueryGenerator(
+    api_key=OPENROUTER_API_KEY,
+    base_url=OPENROUTER_BASE_URL,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    connection_limit=LLM_CONNECTION_LIMIT,
+    stream=LLM_STREAM,
+    compact_prompt=LLM_COMPACT_PROMPT,
+    backends=parse_backends(LLM_BACKENDS, OPENROUTER_BASE_URL) or None,
+    hedge_after=LLM_HEDGE_AFTER,
+    failure_threshold=LLM_BREAKER_THRESHOLD,
+    cooldown=LLM_BREAKER_COOLDOWN,
+    validator=sql_validator.is_safe
+)
+# Имена моделей содержат "/" и ":", поэтому в метриках бэкенды нумеруются по порядку цепочки
+for index, backend in enumerate(generator.backends):
+    metrics.register_stats(f"llm_backend_{index}", backend.stats)
+    logger.info(f"LLM #{index}: {backend.model} ({backend.base_url})")
+
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     logger.info(f"Пользователь {message.from_user.id} запустил бота")
     await message.answer("Введите запрос")
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        logger.warning(f"Пользователь {message.from_user.id} запросил /stats без прав")
+        return
+    report = metrics.render_text()
+    if statement_cache is not None:
+        report += "\n\n" + statement_cache.report()
+    await message.answer(report)
+
 engine = None
 AsyncSessionLocal = None
 
@@ -53,7 +200,10 @@ async def init_db():
         pool_size=10,
         max_overflow=20,
         pool_pre_ping=True,
-        pool_recycle=3600 
+        pool_recycle=3600,
+        # Таймаут задается для каждого соединения пула, поэтому действует
+        # во всех сессиях get_db_session без лишнего SET на каждый запрос
+        connect_args={"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
     )
     
     AsyncSessionLocal = async_sessionmaker(
@@ -77,90 +227,441 @@ async def get_db_session():
             await session.close()
 
 
-async def get_result(session: AsyncSession, query: str) -> str:
+async def get_result(session: AsyncSession, query: str, params: dict = None) -> Optional[str]:
+    # None — запрос не выполнен (отклонен по плану, прерван или с ошибкой)
+    await result_cache.refresh_version(session)
+    cached = result_cache.get(query, params)
+    if cached is not None:
+        logger.info(f"Результат взят из кеша: {cached}")
+        return cached
+
+    answer = await get_replica_result(query, params)
+    if answer is not None:
+        logger.info(f"Результат посчитан колоночной репликой: {answer}")
+        result_cache.put(query, answer, params)
+        return answer
+
+    shared_key = result_cache.shared_key(query, params) if state.shared else None
+    if shared_key:
+        cached = await state.get(shared_key)
+        if cached is not None:
+            logger.info(f"Результат взят из общего кеша: {cached}")
+            result_cache.put(query, cached, params)
+            return cached
+
+    # Запросы из шаблонов (с параметрами) заранее известны и дешевы,
+    # план проверяем только у SQL, сгенерированного LLM
+    if params is None and not await query_guard.admit(session, query):
+        return None
+
     try:
         logger.info(f"Выполняем SQL: {query[:200]}...")
-        result = await session.execute(text(query))
-        value = result.scalar()   
+        prepared, value = await statement_cache.fetchval(session, query, params) if statement_cache else (False, None)
+        if not prepared:
+            result = await session.execute(text(query), params or {})
+            value = result.scalar()
 
-        if value is None:
-            logger.info("Результат запроса: None")
-            return "0"
-        
+        answer = "0" if value is None else str(value)
         logger.info(f"Результат запроса: {value}")
-        return str(value)
+        result_cache.put(query, answer, params)
+        if shared_key:
+            await state.set(shared_key, answer, ttl=SHARED_RESULT_TTL)
+        return answer
         
     except Exception as e:
-        logger.error(f"Ошибка выполнения запроса: {e}, SQL: {query[:200]}...")
-        return "0"
+        if is_statement_timeout(e):
+            query_guard.aborted += 1
+            logger.warning(f"Запрос прерван по statement_timeout ({STATEMENT_TIMEOUT_MS} мс): {query[:200]}...")
+        else:
+            logger.error(f"Ошибка выполнения запроса: {e}, SQL: {query[:200]}...")
+        return None
     
+async def refresh_replica():
+    # Реплика догоняет БД по updated_at после каждой загрузки (смена data_version).
+    # Обновление идет на своей сессии без statement_timeout и не занимает
+    # слот планировщика: пользовательские запросы его не ждут
+    try:
+        async with get_db_session() as session:
+            await session.execute(text("SET LOCAL statement_timeout = 0"))
+            await result_cache.refresh_version(session)
+            await replica.refresh(session, result_cache.version)
+    except Exception as e:
+        logger.error(f"Не удалось обновить колоночную реплику: {e}")
+
+
+async def replica_loop():
+    while True:
+        await asyncio.sleep(REPLICA_REFRESH_INTERVAL)
+        await refresh_replica()
+
+
+async def get_replica_result(query: str, params: dict = None):
+    # Пока реплика не догнала текущую версию, отвечает PostgreSQL
+    if replica is None or replica.version != result_cache.version:
+        return None
+    with metrics.timer("replica"):
+        return replica.answer(query, params)
+
+
 def is_safe_sql(query: str) -> bool:
-    query_lower = query.strip().lower()        
-    if not query_lower.startswith('select'):
-        return False    
-    
-    query_clean = re.sub(r'--.*?\n|/\*.*?\*/', '', query_lower, flags=re.DOTALL)    
-    
-    statements = [s.strip() for s in query_clean.split(';') if s.strip()]
-    if len(statements) != 1:
-        return False    
-   
-    statement = statements[0]
-    if not statement.startswith('select'):
-        return False
-    
-    dangerous_keywords = [
-        r'\binsert\b', r'\bupdate\b', r'\bdelete\b',
-        r'\bdrop\b', r'\btruncate\b', r'\bcreate\b',
-        r'\balter\b', r'\bgrant\b', r'\brevoke\b',
-        r'\bexec(ute)?\b', r'\bunion\b',
-        r'information_schema\b', r'pg_',
-        r'\bcurrent_user\b', r'\bsession_user\b',
-        r'\binto\b\s+(\w+\.)?\w*\s*(\(|values)',
-    ]
-    
-    for pattern in dangerous_keywords:
-        if re.search(pattern, statement, re.IGNORECASE):
-            return False
-    
-    return True
+    return sql_validator.is_safe(query)
 
 
-@dp.message(F.text)
-async def echo(message: Message):    
-    user_id = message.from_user.id
-    user_query = message.text.strip()
-    logger.info(f"Получен запрос от {user_id}: {user_query}")
-    
-    generator = SqlQueryGenerator(api_key=OPENROUTER_API_KEY)
-    
+async def forget_sql(question: str):
+    # SQL попадает в кеши сразу после генерации; если в БД он не выполнился,
+    # удаляем его, чтобы следующий такой же вопрос ушел в LLM заново
+    query_cache.discard(question)
+    if state.shared:
+        await state.delete(f"sql:{normalize_question(question)}")
+
+
+async def build_sql(user_id: int, user_query: str):
+    with metrics.timer("template"):
+        template = template_matcher.match(user_query)
+    if template is not None:
+        logger.info(f"SQL для {user_id} построен по шаблону: {template[0]} {template[1]}")
+        return template
+
+    sql_query = query_cache.get(user_query)
+    if sql_query is not None:
+        logger.info(f"SQL для {user_id} взят из кеша: {sql_query} ({query_cache.stats()})")
+        return sql_query, None
+
+    key = normalize_question(user_query)
+    # Отметку "запрос к LLM выполняется" снимает только процесс, который ее поставил
+    token = None
+    if state.shared:
+        sql_query = await state.get(f"sql:{key}")
+        if sql_query is not None:
+            logger.info(f"SQL для {user_id} взят из общего кеша: {sql_query}")
+            query_cache.put(user_query, sql_query)
+            return sql_query, None
+
+        # Тот же вопрос уже генерирует другой процесс: ждем его результат
+        # в общем кеше вместо второго запроса к LLM
+        token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        if not await state.set_if_absent(f"inflight:{key}", token, ttl=generator.timeout):
+            token = None
+            sql_query = await wait_for_shared_sql(key, timeout=generator.timeout)
+            if sql_query is not None:
+                logger.info(f"SQL для {user_id} получен от другого процесса: {sql_query}")
+                metrics.inc("llm_coalesced_shared")
+                return sql_query, None
+
     try:
+        started = time.perf_counter()
         sql_query = await generator.generate_query(user_query = user_query)
+        llm_latency = time.perf_counter() - started
+        metrics.observe("llm", llm_latency)
         logger.info(f"Сгенерирован SQL для {user_id}: {sql_query}")
     except Exception as e:
         logger.error(f"Ошибка генерации SQL для {user_id}: {e}")
-        await message.answer("0")
-        return
-    
-    if not is_safe_sql(sql_query):
+        metrics.inc("llm_errors")
+        await release_inflight(key, token)
+        return None
+
+    with metrics.timer("safety"):
+        safe = is_safe_sql(sql_query)
+    if not safe:
         logger.warning(f"Небезопасный SQL от {user_id}: {sql_query}")
+        metrics.inc("unsafe_sql")
+        await release_inflight(key, token)
+        return None
+
+    query_cache.put(user_query, sql_query, latency=llm_latency)
+    if state.shared:
+        await state.set(f"sql:{key}", sql_query, ttl=QUERY_CACHE_TTL)
+        await release_inflight(key, token)
+    return sql_query, None
+
+
+async def release_inflight(key: str, token: Optional[str]):
+    if token is not None:
+        await state.delete_if_equals(f"inflight:{key}", token)
+
+
+async def wait_for_shared_sql(key: str, timeout: float, interval: float = 0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        sql_query = await state.get(f"sql:{key}")
+        if sql_query is not None:
+            return sql_query
+        # Генерировавший процесс завершился с ошибкой и снял отметку
+        if await state.get(f"inflight:{key}") is None:
+            return None
+        await asyncio.sleep(interval)
+    return None
+
+
+async def is_rate_limited(user_id: int) -> bool:
+    if not RATE_LIMIT_PER_MINUTE:
+        return False
+    window = int(time.time() // 60)
+    count = await state.incr(f"rate:{user_id}:{window}", ttl=60)
+    return count > RATE_LIMIT_PER_MINUTE
+
+
+_QUESTION_END_RE = re.compile(r'(?<=\?)\s+')
+_NUMBERING_RE = re.compile(r'^(?:\d+[.)]|[-•*])\s+')
+
+
+def split_questions(text: str) -> list:
+    # Сообщение делится на вопросы, только если это видно явно: каждая
+    # строка пронумерована ("1." / "2)") или начинается с маркера списка,
+    # либо каждая часть заканчивается знаком "?" и таких частей несколько.
+    # Вопрос, просто перенесенный на новую строку, остается одним вопросом
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1 and all(_NUMBERING_RE.match(line) for line in lines):
+        return [_NUMBERING_RE.sub('', line).strip() for line in lines]
+
+    parts = [part.strip() for part in _QUESTION_END_RE.split(text.strip()) if part.strip()]
+    if len(parts) > 1 and all(part.endswith('?') for part in parts):
+        return [_NUMBERING_RE.sub('', part).strip() for part in parts]
+    return [text.strip()]
+
+
+async def build_batch_sql(user_id: int, questions: list) -> list:
+    built = [None] * len(questions)
+    missing = []
+    for i, question in enumerate(questions):
+        with metrics.timer("template"):
+            template = template_matcher.match(question)
+        if template is not None:
+            built[i] = template
+            continue
+        sql_query = query_cache.get(question)
+        if sql_query is not None:
+            built[i] = (sql_query, None)
+            continue
+        missing.append(i)
+
+    if not missing:
+        return built
+
+    try:
+        started = time.perf_counter()
+        sql_queries = await generator.generate_batch([questions[i] for i in missing])
+        llm_latency = time.perf_counter() - started
+        metrics.observe("llm", llm_latency)
+        logger.info(f"Сгенерирован SQL для {user_id}: {len(missing)} вопросов одним запросом")
+    except Exception as e:
+        logger.error(f"Ошибка генерации SQL для {user_id}: {e}")
+        metrics.inc("llm_errors")
+        return built
+
+    for i, sql_query in zip(missing, sql_queries):
+        with metrics.timer("safety"):
+            safe = is_safe_sql(sql_query)
+        if not safe:
+            logger.warning(f"Небезопасный SQL от {user_id}: {sql_query}")
+            metrics.inc("unsafe_sql")
+            continue
+        built[i] = (sql_query, None)
+        query_cache.put(questions[i], sql_query, latency=llm_latency / len(missing))
+        if state.shared:
+            await state.set(f"sql:{normalize_question(questions[i])}", sql_query, ttl=QUERY_CACHE_TTL)
+    return built
+
+
+async def get_results(session: AsyncSession, queries: list) -> list:
+    # Ответы из кеша и реплики берутся сразу, остальные запросы уходят
+    # в БД одним SELECT (q1), (q2), ...; None — как в get_result
+    await result_cache.refresh_version(session)
+    answers = [None] * len(queries)
+    pending = []
+    for i, built in enumerate(queries):
+        if built is None:
+            continue
+        query, params = built
+        cached = result_cache.get(query, params)
+        if cached is None:
+            cached = await get_replica_result(query, params)
+        if cached is not None:
+            answers[i] = cached
+            continue
+        if params is None and not await query_guard.admit(session, query):
+            continue
+        pending.append(i)
+
+    if not pending:
+        return answers
+
+    combined, combined_params = combine_queries([queries[i] for i in pending])
+    try:
+        logger.info(f"Выполняем {len(pending)} запросов одним SQL: {combined[:200]}...")
+        result = await session.execute(text(combined), combined_params)
+        row = result.one()
+    except Exception as e:
+        await session.rollback()
+        if is_statement_timeout(e):
+            query_guard.aborted += 1
+            logger.warning(f"Объединенный запрос прерван по statement_timeout ({STATEMENT_TIMEOUT_MS} мс)")
+            return answers
+        # Один неудачный подзапрос (ошибка или больше одной строки) не должен
+        # оставить без ответа остальные: выполняем их по отдельности
+        logger.warning(f"Объединенный запрос не выполнен ({e}), выполняем запросы по отдельности")
+        for i in pending:
+            answers[i] = await get_result(session, *queries[i])
+        return answers
+
+    for i, value in zip(pending, row):
+        answer = "0" if value is None else str(value)
+        result_cache.put(queries[i][0], answer, queries[i][1])
+        answers[i] = answer
+    return answers
+
+
+async def process_batch(message: Message, questions: list, dropped: int = 0):
+    user_id = message.from_user.id
+    logger.info(f"Сообщение {user_id} содержит {len(questions)} вопросов, обрабатываем пакетом")
+    metrics.inc("batch_questions", len(questions))
+
+    queries = await build_batch_sql(user_id, questions)
+    try:
+        async with scheduler.db:
+            with metrics.timer("db"):
+                async with get_db_session() as session:
+                    answers = await get_results(session, queries)
+    except Exception as e:
+        logger.error(f"Ошибка БД для {user_id}: {e}")
+        metrics.inc("db_errors")
+        answers = ["0"] * len(questions)
+
+    for i, (question, built) in enumerate(zip(questions, queries)):
+        if answers[i] is None:
+            if built is not None and built[1] is None:
+                await forget_sql(question)
+            answers[i] = "0"
+
+    reply = "\n".join(f"{i}. {answer}" for i, answer in enumerate(answers, 1))
+    if dropped:
+        reply += (
+            f"\n\nОтвечено на первые {len(questions)} вопросов из {len(questions) + dropped}, "
+            f"остальные отправьте отдельным сообщением"
+        )
+    logger.info(f"Отправлен ответ {user_id}: {answers}")
+    with metrics.timer("reply"):
+        await message.answer(reply)
+
+
+async def process_message(message: Message):
+    user_id = message.from_user.id
+    user_query = message.text.strip()
+
+    if BATCH_MAX_QUESTIONS > 1:
+        questions = split_questions(user_query)
+        if len(questions) > 1:
+            dropped = max(0, len(questions) - BATCH_MAX_QUESTIONS)
+            if dropped:
+                logger.warning(f"В сообщении {user_id} {len(questions)} вопросов, отвечаем на первые {BATCH_MAX_QUESTIONS}")
+            await process_batch(message, questions[:BATCH_MAX_QUESTIONS], dropped)
+            return
+
+    built = await build_sql(user_id, user_query)
+    if built is None:
         await message.answer("0")
         return
+    sql_query, sql_params = built
 
     try:
-        async with get_db_session() as session:
-            result = await get_result(session, sql_query)
+        async with scheduler.db:
+            with metrics.timer("db"):
+                async with get_db_session() as session:
+                    result = await get_result(session, sql_query, sql_params)
     except Exception as e:
         logger.error(f"Ошибка БД для {user_id}: {e}")
+        metrics.inc("db_errors")
         await message.answer("0")
         return
+
+    if result is None:
+        if sql_params is None:
+            await forget_sql(user_query)
+        result = "0"
     
     logger.info(f"Отправлен ответ {user_id}: {result}")
-    await message.answer(result)
+    with metrics.timer("reply"):
+        await message.answer(result)
+
+
+@dp.message(F.text)
+async def echo(message: Message):    
+    user_id = message.from_user.id
+    logger.info(f"Получен запрос от {user_id}: {message.text.strip()}")
+    metrics.inc("requests")
+    received = time.perf_counter()
+
+    if await is_rate_limited(user_id):
+        logger.warning(f"Пользователь {user_id} превысил лимит {RATE_LIMIT_PER_MINUTE} запросов в минуту")
+        metrics.inc("rate_limited")
+        await message.answer("Слишком много запросов, попробуйте через минуту")
+        return
+
+    future = scheduler.submit(user_id, lambda: process_message(message))
+    try:
+        await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if not future.cancelled():
+            raise
+        logger.info(f"Запрос {user_id} отменен при остановке")
+        return
+    except RequestSuperseded:
+        logger.info(f"Запрос {user_id} вытеснен более новым вопросом")
+        await message.reply("Отменено: отвечаю на ваш новый вопрос")
+        return
+    except Exception:
+        await message.answer("0")
+    metrics.observe("total", time.perf_counter() - received)
+    logger.info(f"Планировщик: {scheduler.stats()}")
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(port: int = METRICS_PORT):
+    # Метрики отдаются отдельным сервером, по умолчанию только на localhost:
+    # публичный порт webhook их не показывает
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=METRICS_HOST, port=port).start()
+    logger.info(f"Метрики Prometheus доступны на {METRICS_HOST}:{port} (/metrics)")
+    return runner
+
+async def startup():
+    global replica_task
+    await init_db()
+    if replica is not None:
+        await refresh_replica()
+        replica_task = asyncio.create_task(replica_loop())
+    query_cache.start()
+    scheduler.start()
+
+
+async def shutdown():
+    if replica_task is not None:
+        replica_task.cancel()
+    await scheduler.stop()
+    logger.info(f"Статистика планировщика: {scheduler.stats()}")
+    if engine:
+        logger.info("Закрываем соединения с БД...")
+        await engine.dispose()
+    await generator.close()
+    await state.close()
+    await bot.session.close()
+    logger.info(f"Объединено одинаковых запросов к LLM: {generator.coalesced}")
+    logger.info(f"Статистика шаблонов: {template_matcher.stats()}")
+    logger.info(f"Статистика кеша запросов: {query_cache.stats()}")
+    logger.info(f"Статистика кеша результатов: {result_cache.stats()}")
+    await query_cache.close()
+
 
 async def main():   
     logger.info("=== ЗАПУСК БОТА ===")
-    await init_db()
+    await startup()
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
     
     try:
         logger.info("Бот запущен, ожидаем сообщения...")
@@ -170,10 +671,89 @@ async def main():
     except Exception as e:
         logger.critical(f"Критическая ошибка: {e}", exc_info=True)
     finally:
-        if engine:
-            logger.info("Закрываем соединения с БД...")
-            await engine.dispose()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await shutdown()
         logger.info("=== БОТ ОСТАНОВЛЕН ===")
+        log_listener.stop()
+
+
+async def run_webhook():
+    logger.info(f"=== ЗАПУСК ОБРАБОТЧИКА WEBHOOK (pid {os.getpid()}) ===")
+    await startup()
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+
+    # У каждого процесса свои метрики и свой порт: METRICS_PORT + номер процесса
+    metrics_runner = await start_metrics_server(METRICS_PORT + WEB_WORKER_INDEX) if METRICS_PORT else None
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # reuse_port позволяет нескольким процессам слушать один порт,
+    # ядро само распределяет соединения между ними
+    await web.TCPSite(runner, host=WEB_HOST, port=WEB_PORT, reuse_port=WEB_WORKERS > 1).start()
+    logger.info(f"Webhook слушает {WEB_HOST}:{WEB_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await shutdown()
+        logger.info(f"=== ОБРАБОТЧИК WEBHOOK ОСТАНОВЛЕН (pid {os.getpid()}) ===")
+
+
+def webhook_worker():
+    try:
+        asyncio.run(run_webhook())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_listener.stop()
+
+
+async def register_webhook():
+    await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+    await bot.session.close()
+    logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+
+def run_webhook_workers():
+    asyncio.run(register_webhook())
+
+    if WEB_WORKERS <= 1:
+        webhook_worker()
+        return
+
+    if not REDIS_URL:
+        logger.warning("WEB_WORKERS > 1 без REDIS_URL: кеши и лимиты не будут общими для процессов")
+
+    # spawn: каждый процесс заново создает соединения, кеши и цикл событий
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=webhook_worker, name=f"webhook-{i}")
+        for i in range(WEB_WORKERS)
+    ]
+    for index, process in enumerate(processes):
+        # spawn передает процессу окружение на момент start()
+        os.environ["WEB_WORKER_INDEX"] = str(index)
+        process.start()
+    logger.info(f"Запущено {WEB_WORKERS} процессов webhook")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен пользователем")
+        for process in processes:
+            process.join()
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if WEBHOOK_URL:
+        run_webhook_workers()
+    else:
+        asyncio.run(main())
\ No newline at end of file
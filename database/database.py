@@ -1,10 +1,20 @@
 import aiofiles
+import asyncio
+import asyncpg
+import atexit
+import codecs
+import multiprocessing
 import os
 import json
-from datetime import datetime
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 import uuid
 from dotenv import load_dotenv
 from sqlalchemy import text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from models import Base, Video, VideoSnapshot
@@ -20,6 +30,250 @@ if not DATABASE_URL:
     logger.error("DATABASE_URL не установлен в .env файле")
     sys.exit(1)
 
+# Шаг секционирования video_snapshots по created_at: 'day' или 'month'
+SNAPSHOT_PARTITION = os.getenv("SNAPSHOT_PARTITION", "month")
+PARTITIONS = ('day', 'month')
+
+VIDEO_COLUMNS = (
+    'id', 'creator_id', 'video_created_at',
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'created_at', 'updated_at',
+)
+
+SNAPSHOT_COLUMNS = (
+    'id', 'video_id',
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+    'created_at', 'updated_at',
+)
+
+# Версия данных увеличивается после каждой загрузки: бот сбрасывает
+# кеш результатов, когда видит новую версию
+BUMP_DATA_VERSION_SQL = (
+    "INSERT INTO data_version (id, version, updated_at) VALUES (1, 1, now()) "
+    "ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1, updated_at = now() "
+    "RETURNING version"
+)
+
+# Отметка максимального updated_at по каждой таблице: инкрементальная
+# загрузка пропускает строки, которые не изменились с прошлого раза
+RECORD_WATERMARKS_SQL = (
+    "INSERT INTO ingest_watermarks (table_name, high_water_mark, updated_at) "
+    "SELECT 'videos', MAX(updated_at), now() FROM videos "
+    "UNION ALL SELECT 'video_snapshots', MAX(updated_at), now() FROM video_snapshots "
+    "ON CONFLICT (table_name) DO UPDATE "
+    "SET high_water_mark = EXCLUDED.high_water_mark, updated_at = now()"
+)
+
+# Индексы создаются после загрузки: массовая вставка в таблицу без
+# индексов быстрее, а построение индекса одним проходом дешевле
+INDEX_STATEMENTS = (
+    "CREATE INDEX IF NOT EXISTS ix_videos_creator_id ON videos (creator_id)",
+    "CREATE INDEX IF NOT EXISTS ix_videos_video_created_at ON videos (video_created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_video_snapshots_video_id_created_at ON video_snapshots (video_id, created_at)",
+    # Снапшоты пишутся по времени, поэтому BRIN по created_at компактен
+    # и отсекает почти все блоки при фильтре по дате
+    "CREATE INDEX IF NOT EXISTS ix_video_snapshots_created_at_brin ON video_snapshots USING brin (created_at)",
+)
+
+_DELTA_SUMS = (
+    "SUM(s.delta_views_count) AS delta_views_count, "
+    "SUM(s.delta_likes_count) AS delta_likes_count, "
+    "SUM(s.delta_comments_count) AS delta_comments_count, "
+    "SUM(s.delta_reports_count) AS delta_reports_count, "
+    "COUNT(*) AS snapshots_count"
+)
+
+# Витрины приращений по дням и часам. Почасовая витрина по отдельному видео
+# не строится: снапшоты и так снимаются раз в час, она повторяла бы video_snapshots
+ROLLUPS = {
+    'video_daily_stats': (
+        "SELECT s.video_id, v.creator_id, (s.created_at AT TIME ZONE 'UTC')::date AS day, "
+        f"{_DELTA_SUMS} "
+        "FROM video_snapshots s JOIN videos v ON v.id = s.video_id "
+        "GROUP BY s.video_id, v.creator_id, day",
+        "(video_id, day)"
+    ),
+    'creator_daily_stats': (
+        "SELECT v.creator_id, (s.created_at AT TIME ZONE 'UTC')::date AS day, "
+        f"{_DELTA_SUMS} "
+        "FROM video_snapshots s JOIN videos v ON v.id = s.video_id "
+        "GROUP BY v.creator_id, day",
+        "(creator_id, day)"
+    ),
+    'creator_hourly_stats': (
+        "SELECT v.creator_id, date_trunc('hour', s.created_at) AS hour, "
+        f"{_DELTA_SUMS} "
+        "FROM video_snapshots s JOIN videos v ON v.id = s.video_id "
+        "GROUP BY v.creator_id, hour",
+        "(creator_id, hour)"
+    ),
+}
+
+_SNAPSHOT_CREATED_AT = SNAPSHOT_COLUMNS.index('created_at')
+_PARTITION_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+_VIDEOS_ARRAY_RE = re.compile(r'"videos"\s*:\s*\[')
+_VIDEOS_ARRAY_BYTES_RE = re.compile(rb'"videos"\s*:\s*\[')
+
+
+def parse_datetime(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def asyncpg_dsn() -> str:
+    # asyncpg не понимает драйвер в схеме SQLAlchemy (postgresql+asyncpg://)
+    url = make_url(DATABASE_URL).set(drivername='postgresql')
+    return url.render_as_string(hide_password=False)
+
+
+def peak_rss() -> str:
+    # Модуль resource есть только на Unix: на Windows пик памяти не сообщаем
+    try:
+        import resource
+    except ImportError:
+        return "н/д"
+    # На Linux ru_maxrss возвращается в килобайтах
+    return f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ"
+
+
+def video_record(video_data: dict) -> tuple:
+    return (
+        uuid.UUID(video_data['id']),
+        str(video_data['creator_id']),
+        parse_datetime(video_data['video_created_at']),
+        video_data['views_count'],
+        video_data['likes_count'],
+        video_data['comments_count'],
+        video_data['reports_count'],
+        parse_datetime(video_data['created_at']),
+        parse_datetime(video_data['updated_at']),
+    )
+
+
+def snapshot_records(video_data: dict) -> list:
+    video_id = uuid.UUID(video_data['id'])
+    return [
+        (
+            str(snapshot['id']),
+            video_id,
+            snapshot['views_count'],
+            snapshot['likes_count'],
+            snapshot['comments_count'],
+            snapshot['reports_count'],
+            snapshot['delta_views_count'],
+            snapshot['delta_likes_count'],
+            snapshot['delta_comments_count'],
+            snapshot['delta_reports_count'],
+            parse_datetime(snapshot['created_at']),
+            parse_datetime(snapshot['updated_at']),
+        )
+        for snapshot in video_data.get('snapshots', [])
+    ]
+
+
+def partition_start(value: datetime, partition: str) -> datetime:
+    value = value.astimezone(timezone.utc)
+    if partition == 'day':
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def partition_end(start: datetime, partition: str) -> datetime:
+    if partition == 'day':
+        return start + timedelta(days=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def create_partition_sql(start: datetime, partition: str) -> str:
+    name = f"video_snapshots_p{start:%Y%m%d}" if partition == 'day' else f"video_snapshots_p{start:%Y%m}"
+    return (
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF video_snapshots "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{partition_end(start, partition).isoformat()}')"
+    )
+
+
+def partition_step(start: datetime, end: datetime) -> Optional[str]:
+    for partition in PARTITIONS:
+        if partition_start(start, partition) == start and partition_end(start, partition) == end:
+            return partition
+    return None
+
+
+def new_partitions(created_at_values, known: set, partition: str) -> list:
+    # Начала секций, которые нужны строкам пачки и еще не созданы в этой загрузке
+    starts = {partition_start(value, partition) for value in created_at_values} - known
+    known.update(starts)
+    return sorted(starts)
+
+
+async def ensure_partitions(conn, snapshot_rows: list, known: set, partition: str):
+    starts = new_partitions((row[_SNAPSHOT_CREATED_AT] for row in snapshot_rows), known, partition)
+    await create_partitions(conn, starts, partition)
+
+
+async def create_partitions(conn, starts: list, partition: str):
+    # CREATE TABLE ... PARTITION OF берет ACCESS EXCLUSIVE на video_snapshots:
+    # транзакция с ним должна быть короткой, иначе запросы бота к снапшотам
+    # ждут ее до statement_timeout
+    if not starts:
+        return
+    # Параллельные загрузчики создают секции по очереди: без блокировки два
+    # CREATE TABLE IF NOT EXISTS одной секции конфликтуют в каталоге
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('video_snapshots_partitions'))")
+        for start in starts:
+            await conn.execute(create_partition_sql(start, partition))
+    logger.info(f"Созданы секции video_snapshots: {', '.join(f'{start:%Y-%m-%d}' for start in starts)}")
+
+
+async def iter_json_videos(json_path: str, chunk_size: int = 1 << 20):
+    # Потоковый разбор массива "videos": в памяти держим только текущий
+    # кусок файла и одно видео со снапшотами, а не весь дамп целиком
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    async with aiofiles.open(json_path, 'r', encoding='utf-8') as f:
+        while True:
+            match = _VIDEOS_ARRAY_RE.search(buffer)
+            if match:
+                pos = match.end()
+                break
+            if eof:
+                raise ValueError(f"В файле {json_path} не найден массив videos")
+            chunk = await f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+
+            if pos < len(buffer):
+                try:
+                    video_data, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield video_data
+                    pos = end
+                    continue
+            elif eof:
+                raise ValueError(f"Неожиданный конец файла {json_path}")
+
+            buffer = buffer[pos:]
+            pos = 0
+            chunk = await f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+
 async def drop_and_create_tables():
     logger.info("Удаляем существующие таблицы...")
     
@@ -36,11 +290,60 @@ async def drop_and_create_tables():
         logger.info("Таблицы удалены")
         
         await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text("DELETE FROM ingest_watermarks"))
         logger.info("Таблицы созданы заново")
     
     return engine
 
-async def load_json_to_db(json_path: str):
+async def create_tables():
+    engine = create_async_engine(DATABASE_URL, echo=False)
+    try:
+        async with engine.begin() as conn:
+            result = await conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('video_snapshots')"))
+            if result.scalar() == 'r':
+                raise RuntimeError(
+                    "Таблица video_snapshots создана без секционирования: выполните полную загрузку без --incremental"
+                )
+            await conn.run_sync(Base.metadata.create_all)
+        logger.info("Таблицы проверены")
+    finally:
+        await engine.dispose()
+
+async def create_indexes_and_rollups():
+    logger.info("Создаем индексы и витрины...")
+    started = time.perf_counter()
+
+    engine = create_async_engine(DATABASE_URL, echo=False)
+
+    try:
+        async with engine.begin() as conn:
+            for statement in INDEX_STATEMENTS:
+                await conn.execute(text(statement))
+            logger.info("Индексы созданы")
+
+            result = await conn.execute(text("SELECT matviewname FROM pg_matviews"))
+            existing = {row[0] for row in result}
+
+            for name, (query, unique_key) in ROLLUPS.items():
+                if name in existing:
+                    # Уникальный индекс позволяет обновлять витрину, не блокируя чтение
+                    await conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+                    logger.info(f"Витрина {name} обновлена")
+                else:
+                    await conn.execute(text(f"CREATE MATERIALIZED VIEW {name} AS {query}"))
+                    await conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{name} ON {name} {unique_key}"))
+                    logger.info(f"Витрина {name} создана")
+
+            await conn.execute(text("ANALYZE videos"))
+            await conn.execute(text("ANALYZE video_snapshots"))
+            result = await conn.execute(text(BUMP_DATA_VERSION_SQL))
+            logger.info(f"Версия данных: {result.scalar()}")
+
+        logger.info(f"Индексы и витрины готовы за {time.perf_counter() - started:.1f} с")
+    finally:
+        await engine.dispose()
+
+async def load_json_to_db(json_path: str, partition: str = SNAPSHOT_PARTITION):
     logger.info(f"Загружаем данные из {json_path}...")
     
     engine = create_async_engine(
@@ -62,7 +365,9 @@ async def load_json_to_db(json_path: str):
 
     videos_count = 0
     snapshots_count = 0
+    partitions = set()
     total_videos = len(data['videos'])
+    started = time.perf_counter()
     
     logger.info(f"Найдено {total_videos} видео для загрузки")
     
@@ -107,6 +412,8 @@ async def load_json_to_db(json_path: str):
                     snapshots_count += 1
                 
                 if len(video_batch) >= batch_size:
+                    for start in new_partitions((s.created_at for s in snapshot_batch), partitions, partition):
+                        await session.execute(text(create_partition_sql(start, partition)))
                     session.add_all(video_batch)
                     session.add_all(snapshot_batch)
                     await session.commit()
@@ -118,11 +425,19 @@ async def load_json_to_db(json_path: str):
                         logger.info(f"Загружено {i}/{total_videos} видео ({progress}%)")
             
             if video_batch:
+                for start in new_partitions((s.created_at for s in snapshot_batch), partitions, partition):
+                    await session.execute(text(create_partition_sql(start, partition)))
                 session.add_all(video_batch)
                 session.add_all(snapshot_batch)
                 await session.commit()
             
-            logger.info(f"Загрузка завершена! Видео: {videos_count}, Снапшотов: {snapshots_count}")
+            elapsed = time.perf_counter() - started
+            total_rows = videos_count + snapshots_count
+            logger.info(
+                f"Загрузка завершена! Видео: {videos_count}, Снапшотов: {snapshots_count}, "
+                f"время {elapsed:.1f} с, {total_rows / elapsed if elapsed else 0:.0f} строк/с, "
+                f"пик RSS {peak_rss()}"
+            )
             
             result = await session.execute(text("SELECT COUNT(*) FROM videos"))
             video_count_db = result.scalar()
@@ -131,10 +446,539 @@ async def load_json_to_db(json_path: str):
             snapshot_count_db = result.scalar()
             
             logger.info(f"Проверка: {video_count_db} видео, {snapshot_count_db} снапшотов в БД")
+
+            await session.execute(text(RECORD_WATERMARKS_SQL))
+            result = await session.execute(text(BUMP_DATA_VERSION_SQL))
+            await session.commit()
+            logger.info(f"Версия данных: {result.scalar()}")
             
     except Exception as e:
         logger.error(f"Ошибка при загрузке данных: {e}", exc_info=True)
         raise
     finally:
         await engine.dispose()
-        logger.info("Соединение с БД закрыто")
\ No newline at end of file
+        logger.info("Соединение с БД закрыто")
+
+
+async def load_json_to_db_copy(json_path: str, batch_rows: int = 50000, partition: str = SNAPSHOT_PARTITION):
+    logger.info(f"Загружаем данные из {json_path} через COPY...")
+
+    videos_count = 0
+    snapshots_count = 0
+    video_batch = []
+    snapshot_batch = []
+    partitions = set()
+    started = time.perf_counter()
+
+    conn = await asyncpg.connect(asyncpg_dsn())
+    try:
+        async def flush():
+            if video_batch:
+                await conn.copy_records_to_table('videos', records=video_batch, columns=VIDEO_COLUMNS)
+            if snapshot_batch:
+                await ensure_partitions(conn, snapshot_batch, partitions, partition)
+                await conn.copy_records_to_table('video_snapshots', records=snapshot_batch, columns=SNAPSHOT_COLUMNS)
+            video_batch.clear()
+            snapshot_batch.clear()
+
+        async with conn.transaction():
+            async for video_data in iter_json_videos(json_path):
+                video_batch.append(video_record(video_data))
+                snapshots = snapshot_records(video_data)
+                snapshot_batch.extend(snapshots)
+                videos_count += 1
+                snapshots_count += len(snapshots)
+
+                if len(video_batch) + len(snapshot_batch) >= batch_rows:
+                    await flush()
+                    elapsed = time.perf_counter() - started
+                    logger.info(
+                        f"Загружено {videos_count} видео, {snapshots_count} снапшотов "
+                        f"({(videos_count + snapshots_count) / elapsed:.0f} строк/с, "
+                        f"пик RSS {peak_rss()})"
+                    )
+
+            await flush()
+            await conn.execute(RECORD_WATERMARKS_SQL)
+            data_version = await conn.fetchval(BUMP_DATA_VERSION_SQL)
+
+        elapsed = time.perf_counter() - started
+        total_rows = videos_count + snapshots_count
+        logger.info(
+            f"Загрузка завершена! Видео: {videos_count}, Снапшотов: {snapshots_count}, "
+            f"время {elapsed:.1f} с, {total_rows / elapsed if elapsed else 0:.0f} строк/с, "
+            f"пик RSS {peak_rss()}"
+        )
+
+        video_count_db = await conn.fetchval("SELECT COUNT(*) FROM videos")
+        snapshot_count_db = await conn.fetchval("SELECT COUNT(*) FROM video_snapshots")
+        logger.info(f"Проверка: {video_count_db} видео, {snapshot_count_db} снапшотов в БД")
+        logger.info(f"Версия данных: {data_version}")
+
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке данных: {e}", exc_info=True)
+        raise
+    finally:
+        await conn.close()
+        logger.info("Соединение с БД закрыто")
+
+
+def _upsert_sql(table: str, staging: str, columns: tuple, key: tuple = ('id',)) -> str:
+    # Из staging берем последнюю версию каждой строки и обновляем
+    # существующую только если ее updated_at действительно вырос
+    column_list = ", ".join(columns)
+    key_list = ", ".join(key)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in key)
+    return (
+        f"INSERT INTO {table} ({column_list}) "
+        f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging} ORDER BY {key_list}, updated_at DESC "
+        f"ON CONFLICT ({key_list}) DO UPDATE SET {updates} "
+        f"WHERE {table}.updated_at IS NULL OR {table}.updated_at < EXCLUDED.updated_at"
+    )
+
+
+def _watermark_sql(table: str, staging: str) -> str:
+    return (
+        "INSERT INTO ingest_watermarks (table_name, high_water_mark, updated_at) "
+        f"SELECT '{table}', MAX(updated_at), now() FROM {staging} HAVING MAX(updated_at) IS NOT NULL "
+        "ON CONFLICT (table_name) DO UPDATE SET "
+        "high_water_mark = GREATEST(ingest_watermarks.high_water_mark, EXCLUDED.high_water_mark), updated_at = now()"
+    )
+
+
+async def load_json_to_db_incremental(json_path: str, batch_rows: int = 50000, partition: str = SNAPSHOT_PARTITION):
+    logger.info(f"Инкрементальная загрузка из {json_path}...")
+
+    seen_rows = 0
+    video_batch = []
+    snapshot_batch = []
+    staged = {'videos': 0, 'video_snapshots': 0}
+    partitions = set()
+    started = time.perf_counter()
+
+    conn = await asyncpg.connect(asyncpg_dsn())
+    try:
+        watermarks = dict(await conn.fetch("SELECT table_name, high_water_mark FROM ingest_watermarks"))
+        video_mark = watermarks.get('videos')
+        snapshot_mark = watermarks.get('video_snapshots')
+        logger.info(f"Отметки прошлой загрузки: видео {video_mark}, снапшоты {snapshot_mark}")
+        await check_partition_step(conn, partition)
+
+        async def flush():
+            if video_batch:
+                await conn.copy_records_to_table('videos_staging', records=video_batch, columns=VIDEO_COLUMNS)
+                staged['videos'] += len(video_batch)
+            if snapshot_batch:
+                starts.extend(new_partitions((row[_SNAPSHOT_CREATED_AT] for row in snapshot_batch), partitions, partition))
+                await conn.copy_records_to_table('video_snapshots_staging', records=snapshot_batch, columns=SNAPSHOT_COLUMNS)
+                staged['video_snapshots'] += len(snapshot_batch)
+            video_batch.clear()
+            snapshot_batch.clear()
+
+        # Промежуточные таблицы живут до конца сессии и заполняются вне
+        # транзакции: ни LIKE, ни COPY не держат блокировки на videos и
+        # video_snapshots все время разбора файла
+        starts = []
+        await conn.execute("CREATE TEMP TABLE videos_staging (LIKE videos)")
+        await conn.execute("CREATE TEMP TABLE video_snapshots_staging (LIKE video_snapshots)")
+
+        async for video_data in iter_json_videos(json_path):
+            video = video_record(video_data)
+            snapshots = snapshot_records(video_data)
+            seen_rows += 1 + len(snapshots)
+
+            if video_mark is None or video[-1] > video_mark:
+                video_batch.append(video)
+            snapshot_batch.extend(
+                snapshot for snapshot in snapshots
+                if snapshot_mark is None or snapshot[-1] > snapshot_mark
+            )
+
+            if len(video_batch) + len(snapshot_batch) >= batch_rows:
+                await flush()
+
+        await flush()
+
+        # Недостающие секции создаются отдельной короткой транзакцией, а
+        # данные переносятся одной транзакцией: бот до ее фиксации читает
+        # старые данные и не ждет блокировок DDL
+        await create_partitions(conn, sorted(starts), partition)
+        async with conn.transaction():
+            video_status = await conn.execute(_upsert_sql('videos', 'videos_staging', VIDEO_COLUMNS))
+            snapshot_status = await conn.execute(
+                # Ключ секционированной таблицы включает created_at, время замера у снапшота не меняется
+                _upsert_sql('video_snapshots', 'video_snapshots_staging', SNAPSHOT_COLUMNS, key=('id', 'created_at'))
+            )
+            await conn.execute(_watermark_sql('videos', 'videos_staging'))
+            await conn.execute(_watermark_sql('video_snapshots', 'video_snapshots_staging'))
+            data_version = await conn.fetchval(BUMP_DATA_VERSION_SQL)
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Инкрементальная загрузка завершена за {elapsed:.1f} с: просмотрено {seen_rows} строк, "
+            f"новых/измененных видео {staged['videos']} ({video_status}), "
+            f"снапшотов {staged['video_snapshots']} ({snapshot_status}), "
+            f"пик RSS {peak_rss()}"
+        )
+        logger.info(f"Версия данных: {data_version}")
+
+    except Exception as e:
+        logger.error(f"Ошибка при инкрементальной загрузке: {e}", exc_info=True)
+        raise
+    finally:
+        await conn.close()
+        logger.info("Соединение с БД закрыто")
+
+
+_worker_loop = None
+_worker_conn = None
+_worker_partition = None
+_worker_partitions = set()
+
+
+def _close_load_worker():
+    if _worker_conn is not None:
+        _worker_loop.run_until_complete(_worker_conn.close())
+    if _worker_loop is not None:
+        _worker_loop.close()
+
+
+def _init_load_worker(dsn: str, partition: str):
+    # У каждого процесса свой цикл событий и свое соединение с БД,
+    # поэтому процессы пишут в PostgreSQL параллельно
+    global _worker_loop, _worker_conn, _worker_partition
+    _worker_partition = partition
+    _worker_loop = asyncio.new_event_loop()
+    _worker_conn = _worker_loop.run_until_complete(asyncpg.connect(dsn))
+    atexit.register(_close_load_worker)
+
+
+def videos_array_offset(json_path: str, chunk_size: int = 1 << 16) -> int:
+    # Байтовое смещение первого элемента массива "videos"
+    with open(json_path, 'rb') as f:
+        head = b''
+        while True:
+            chunk = f.read(chunk_size)
+            head += chunk
+            match = _VIDEOS_ARRAY_BYTES_RE.search(head)
+            if match:
+                return match.end()
+            if not chunk:
+                raise ValueError(f"В файле {json_path} не найден массив videos")
+
+
+def _is_video(value) -> bool:
+    # По этим полям видео отличается от снапшота: так находится начало
+    # первого видео диапазона без разбора файла с начала
+    return isinstance(value, dict) and 'creator_id' in value and 'video_created_at' in value
+
+
+class _RangeText:
+    # Текст файла с байта start, дочитывается кусками по мере разбора.
+    # byte_pos переводит позицию символа в байтовое смещение в файле
+    def __init__(self, f, start: int, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        f.seek(start)
+        chunk = f.read(chunk_size)
+        # Граница диапазона может попасть в середину символа UTF-8
+        skip = 0
+        while skip < len(chunk) and 0x80 <= chunk[skip] < 0xC0:
+            skip += 1
+        self.text = self.utf8.decode(chunk[skip:], final=not chunk)
+        self.eof = not chunk
+        self._mark_char = 0
+        self._mark_byte = start + skip
+
+    def byte_pos(self, i: int) -> int:
+        # Позиции запрашиваются по возрастанию: кодируем только прирост
+        self._mark_byte += len(self.text[self._mark_char:i].encode('utf-8'))
+        self._mark_char = i
+        return self._mark_byte
+
+    def more(self, keep_from: int) -> int:
+        # Отбрасывает разобранное до keep_from и дочитывает следующий кусок;
+        # возвращает новую позицию keep_from или -1 в конце файла
+        if self.eof:
+            return -1
+        self.byte_pos(keep_from)
+        chunk = self.f.read(self.chunk_size)
+        self.eof = not chunk
+        self.text = self.text[keep_from:] + self.utf8.decode(chunk, final=self.eof)
+        self._mark_char = 0
+        return 0
+
+
+def _truncated(error: json.JSONDecodeError, text: str) -> bool:
+    # Ошибка у конца прочитанного текста — объект просто еще не дочитан
+    return error.msg.startswith('Unterminated string') or len(text) - error.pos <= 16
+
+
+def iter_range_videos(json_path: str, start: int, end: int, first: bool, chunk_size: int = 1 << 22):
+    # Видео, которые начинаются в байтах [start, end): последнее дочитывается
+    # за end, а видео, начатое до start, достается предыдущему диапазону.
+    # Поэтому диапазоны режутся по размеру файла, без разбора в основном процессе
+    decoder = json.JSONDecoder()
+    with open(json_path, 'rb') as f:
+        reader = _RangeText(f, start, chunk_size)
+        pos = 0
+
+        while not first:
+            i = reader.text.find('{', pos)
+            if i == -1:
+                pos = reader.more(len(reader.text))
+                if pos == -1:
+                    return
+                continue
+            try:
+                value, value_end = decoder.raw_decode(reader.text, i)
+            except json.JSONDecodeError as e:
+                if _truncated(e, reader.text):
+                    pos = reader.more(i)
+                    if pos != -1:
+                        continue
+                pos = i + 1
+                continue
+            if not _is_video(value):
+                # Снапшот видео, начатого до start, или скобка внутри строки
+                pos = i + 1
+                continue
+            if reader.byte_pos(i) >= end:
+                return
+            yield value
+            pos = value_end
+            first = True
+
+        while True:
+            text = reader.text
+            while pos < len(text) and text[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(text):
+                pos = reader.more(pos)
+                if pos == -1:
+                    raise ValueError(f"Неожиданный конец файла {json_path}")
+                continue
+            if text[pos] == ']' or reader.byte_pos(pos) >= end:
+                return
+            try:
+                value, value_end = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError as e:
+                if _truncated(e, text):
+                    pos = reader.more(pos)
+                    if pos != -1:
+                        continue
+                raise
+            yield value
+            pos = value_end
+
+
+async def _copy_shard(video_rows: list, snapshot_rows: list):
+    # Секции создаются в отдельной короткой транзакции до записи шарда
+    await ensure_partitions(_worker_conn, snapshot_rows, _worker_partitions, _worker_partition)
+    async with _worker_conn.transaction():
+        await _worker_conn.copy_records_to_table('videos', records=video_rows, columns=VIDEO_COLUMNS)
+        if snapshot_rows:
+            await _worker_conn.copy_records_to_table('video_snapshots', records=snapshot_rows, columns=SNAPSHOT_COLUMNS)
+
+
+def _load_range(json_path: str, start: int, end: int, first: bool) -> tuple:
+    started = time.perf_counter()
+    video_rows = []
+    snapshot_rows = []
+    for video_data in iter_range_videos(json_path, start, end, first):
+        video_rows.append(video_record(video_data))
+        snapshot_rows.extend(snapshot_records(video_data))
+    parsed = time.perf_counter()
+
+    if video_rows:
+        _worker_loop.run_until_complete(_copy_shard(video_rows, snapshot_rows))
+    written = time.perf_counter()
+
+    return len(video_rows), len(snapshot_rows), parsed - started, written - parsed
+
+
+async def truncate_tables():
+    conn = await asyncpg.connect(asyncpg_dsn())
+    try:
+        await conn.execute("TRUNCATE video_snapshots, videos")
+    finally:
+        await conn.close()
+
+
+async def load_json_to_db_parallel(
+    json_path: str, workers: int = 4, shard_bytes: int = 8 << 20, partition: str = SNAPSHOT_PARTITION
+):
+    logger.info(f"Параллельная загрузка из {json_path}: {workers} процессов/соединений")
+
+    totals = {'videos': 0, 'snapshots': 0, 'parse': 0.0, 'write': 0.0}
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    def collect(done):
+        for future in done:
+            videos, snapshots, parse_seconds, write_seconds = future.result()
+            totals['videos'] += videos
+            totals['snapshots'] += snapshots
+            totals['parse'] += parse_seconds
+            totals['write'] += write_seconds
+
+    # Основной процесс только делит файл на диапазоны байтов: чтение и разбор
+    # JSON идут в worker-процессах. spawn — потому что у родителя уже есть
+    # цикл событий и потоки aiofiles, которые fork скопировал бы в неготовом виде
+    first_offset = videos_array_offset(json_path)
+    size = os.path.getsize(json_path)
+    ranges = [
+        (start, min(start + shard_bytes, size), start == first_offset)
+        for start in range(first_offset, size, shard_bytes)
+    ]
+
+    # Шарды фиксируются независимо: при ошибке любого из них таблицы
+    # очищаются целиком, чтобы не оставить частичную загрузку
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_load_worker,
+            initargs=(asyncpg_dsn(), partition)
+        ) as pool:
+            try:
+                for start, end, first in ranges:
+                    pending.add(loop.run_in_executor(pool, _load_range, json_path, start, end, first))
+                    # Не больше двух диапазонов на процесс в очереди
+                    if len(pending) >= workers * 2:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        collect(done)
+                        logger.info(f"Загружено {totals['videos']} видео, {totals['snapshots']} снапшотов")
+
+                if pending:
+                    done, pending = await asyncio.wait(pending)
+                    collect(done)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        conn = await asyncpg.connect(asyncpg_dsn())
+        try:
+            video_count_db = await conn.fetchval("SELECT COUNT(*) FROM videos")
+            snapshot_count_db = await conn.fetchval("SELECT COUNT(*) FROM video_snapshots")
+            logger.info(f"Проверка: {video_count_db} видео, {snapshot_count_db} снапшотов в БД")
+            if video_count_db != totals['videos'] or snapshot_count_db != totals['snapshots']:
+                raise RuntimeError("Число строк в БД не совпадает с загруженным")
+
+            await conn.execute(RECORD_WATERMARKS_SQL)
+            data_version = await conn.fetchval(BUMP_DATA_VERSION_SQL)
+            logger.info(f"Версия данных: {data_version}")
+        finally:
+            await conn.close()
+            logger.info("Соединение с БД закрыто")
+    except BaseException as e:
+        logger.error(f"Параллельная загрузка прервана ({e!r}), очищаем частично загруженные таблицы")
+        await truncate_tables()
+        raise
+
+    elapsed = time.perf_counter() - started
+    total_rows = totals['videos'] + totals['snapshots']
+
+    def rate(seconds):
+        return total_rows / seconds if seconds else 0
+
+    logger.info(
+        f"Загрузка завершена! Видео: {totals['videos']}, Снапшотов: {totals['snapshots']}, "
+        f"время {elapsed:.1f} с, {rate(elapsed):.0f} строк/с, пик RSS основного процесса {peak_rss()}"
+    )
+    # Разбор и запись идут в worker-процессах параллельно, поэтому их
+    # пропускная способность — строки на суммарное время, умноженные на число процессов
+    logger.info(
+        f"Этапы: чтение и разбор {rate(totals['parse']) * workers:.0f} строк/с ({totals['parse']:.1f} с CPU), "
+        f"запись {rate(totals['write']) * workers:.0f} строк/с ({totals['write']:.1f} с суммарно)"
+    )
+
+def _parse_bound(value: str) -> datetime:
+    # pg_get_expr печатает смещение как +00, а fromisoformat в Python 3.9 ждет +00:00
+    return datetime.fromisoformat(re.sub(r'([+-]\d{2})$', r'\1:00', value)).astimezone(timezone.utc)
+
+
+async def list_snapshot_partitions(conn) -> list:
+    rows = await conn.fetch(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound, pg_total_relation_size(c.oid) AS size "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'video_snapshots'::regclass ORDER BY c.relname"
+    )
+    partitions = []
+    for row in rows:
+        m = _PARTITION_BOUND_RE.search(row['bound'])
+        if m is None:
+            continue
+        partitions.append((row['relname'], _parse_bound(m[1]), _parse_bound(m[2]), row['size']))
+    return partitions
+
+
+async def check_partition_step(conn, partition: str):
+    # Секции прошлых загрузок должны быть того же шага: дневная секция внутри
+    # уже созданной месячной пересеклась бы с ней, и загрузка упала бы посреди COPY
+    for name, start, end, _ in await list_snapshot_partitions(conn):
+        step = partition_step(start, end)
+        if step == partition:
+            continue
+        hint = f"укажите --partition {step} или " if step else ""
+        raise RuntimeError(
+            f"Секция {name} ({start:%Y-%m-%d} — {end:%Y-%m-%d}) не совпадает с шагом --partition {partition}: "
+            f"{hint}выполните полную загрузку без --incremental"
+        )
+
+
+async def detach_snapshot_partitions(before: datetime, archive_dir: str = None, drop: bool = False) -> list:
+    # Секции, целиком лежащие раньше before, отсоединяются от video_snapshots:
+    # запросы их больше не видят, а таблица остается для архива под именем
+    # <секция>_detached_<время> — иначе следующая загрузка не создала бы секцию
+    # с тем же именем (CREATE TABLE IF NOT EXISTS) и COPY не нашел бы, куда
+    # писать. С archive_dir секция выгружается в CSV и удаляется, с drop —
+    # просто удаляется
+    conn = await asyncpg.connect(asyncpg_dsn())
+    detached = []
+    suffix = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+    try:
+        # На PostgreSQL 14+ DETACH ... CONCURRENTLY не берет ACCESS EXCLUSIVE на
+        # video_snapshots, и запросы бота не ждут. Такой DETACH нельзя выполнять
+        # в транзакции: каждый оператор здесь идет отдельно, в автокоммите.
+        # Прерванный DETACH оставляет секцию в ожидании — ее дозавершает FINALIZE
+        concurrently = conn.get_server_version().major >= 14
+        pending = set()
+        if concurrently:
+            rows = await conn.fetch(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'video_snapshots'::regclass AND i.inhdetachpending"
+            )
+            pending = {row['relname'] for row in rows}
+
+        for name, start, end, size in await list_snapshot_partitions(conn):
+            if end > before and name not in pending:
+                continue
+
+            if name in pending:
+                mode = " FINALIZE"
+            else:
+                mode = " CONCURRENTLY" if concurrently else ""
+            await conn.execute(f"ALTER TABLE video_snapshots DETACH PARTITION {name}{mode}")
+            if archive_dir:
+                path = os.path.join(archive_dir, f"{name}.csv")
+                await conn.copy_from_table(name, output=path, format='csv', header=True)
+                logger.info(f"Секция {name} выгружена в {path}")
+            if archive_dir or drop:
+                await conn.execute(f"DROP TABLE {name}")
+                status = "удалена"
+            else:
+                archived = f"{name}_detached_{suffix}"
+                await conn.execute(f"ALTER TABLE {name} RENAME TO {archived}")
+                status = f"отсоединена как {archived}"
+
+            detached.append(name)
+            logger.info(f"Секция {name} ({start:%Y-%m-%d} — {end:%Y-%m-%d}, {size / 1024 / 1024:.1f} МБ) {status}")
+    finally:
+        await conn.close()
+
+    return detached
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import sys
+import os
+from datetime import date, datetime, timezone
+from dotenv import load_dotenv
+import asyncpg
+from database import asyncpg_dsn, create_indexes_and_rollups, detach_snapshot_partitions, list_snapshot_partitions
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('setup.log', encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Секции таблицы video_snapshots: просмотр и отсоединение старых")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="показать секции, их границы и размер")
+
+    detach = commands.add_parser(
+        "detach", help="отсоединить секции, которые целиком раньше даты (оставленные таблицы получают суффикс _detached_<время>)"
+    )
+    detach.add_argument("--before", required=True, type=date.fromisoformat, help="дата в формате YYYY-MM-DD (UTC)")
+    action = detach.add_mutually_exclusive_group()
+    action.add_argument("--archive", metavar="DIR", help="выгрузить секции в CSV в каталог DIR и удалить")
+    action.add_argument("--drop", action="store_true", help="удалить секции без выгрузки")
+    return parser.parse_args()
+
+async def show_partitions():
+    conn = await asyncpg.connect(asyncpg_dsn())
+    try:
+        partitions = await list_snapshot_partitions(conn)
+    finally:
+        await conn.close()
+
+    for name, start, end, size in partitions:
+        print(f"{name:<28} {start:%Y-%m-%d} — {end:%Y-%m-%d} {size / 1024 / 1024:>10.1f} МБ")
+    print(f"Всего секций: {len(partitions)}")
+
+async def main():
+    args = parse_args()
+
+    try:
+        if args.command == "list":
+            await show_partitions()
+            return
+
+        if args.archive:
+            os.makedirs(args.archive, exist_ok=True)
+        before = datetime.combine(args.before, datetime.min.time(), tzinfo=timezone.utc)
+        detached = await detach_snapshot_partitions(before, archive_dir=args.archive, drop=args.drop)
+        if not detached:
+            logger.info(f"Нет секций целиком раньше {args.before}")
+            return
+
+        # Витрины пересчитываются без отсоединенных секций, а новая версия
+        # данных сбрасывает кеши бота
+        await create_indexes_and_rollups()
+        logger.info(f"Отсоединено секций: {len(detached)}")
+
+    except Exception as e:
+        logger.error(f"Ошибка: {e}", exc_info=True)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, DateTime, String
+from sqlalchemy import Column, BigInteger, Date, DateTime, Integer, MetaData, String, Table
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 import uuid
@@ -20,6 +20,9 @@ class Video(Base):
 
 class VideoSnapshot(Base):
     __tablename__ = 'video_snapshots'
+    # Секции по created_at (день или месяц) создает загрузчик, поэтому
+    # created_at входит в первичный ключ
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_at)'}
     
     id = Column(String, primary_key=True) 
     video_id = Column(UUID(as_uuid=True))
@@ -31,5 +34,62 @@ class VideoSnapshot(Base):
     delta_likes_count = Column(BigInteger)
     delta_comments_count = Column(BigInteger)
     delta_reports_count = Column(BigInteger)
-    created_at = Column(DateTime(timezone=True))
-    updated_at = Column(DateTime(timezone=True))
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), primary_key=True)
+    updated_at = Column(DateTime(timezone=True))
+
+# Служебные таблицы загрузчика: бот читает их сам, в промт LLM и в белый
+# список SqlValidator они не попадают
+SERVICE_TABLES = frozenset(('data_version', 'ingest_watermarks'))
+
+class DataVersion(Base):
+    __tablename__ = 'data_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True))
+
+class IngestWatermark(Base):
+    __tablename__ = 'ingest_watermarks'
+
+    table_name = Column(String, primary_key=True)
+    high_water_mark = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+
+
+# Материализованные витрины создаются SQL-скриптом после загрузки
+# (database.ROLLUPS), поэтому описаны в отдельной MetaData и не попадают
+# в Base.metadata.create_all
+rollups_metadata = MetaData()
+
+
+def _delta_columns():
+    return [
+        Column('delta_views_count', BigInteger),
+        Column('delta_likes_count', BigInteger),
+        Column('delta_comments_count', BigInteger),
+        Column('delta_reports_count', BigInteger),
+        Column('snapshots_count', BigInteger),
+    ]
+
+
+video_daily_stats = Table(
+    'video_daily_stats', rollups_metadata,
+    Column('video_id', UUID(as_uuid=True)),
+    Column('creator_id', String),
+    Column('day', Date),
+    *_delta_columns()
+)
+
+creator_daily_stats = Table(
+    'creator_daily_stats', rollups_metadata,
+    Column('creator_id', String),
+    Column('day', Date),
+    *_delta_columns()
+)
+
+creator_hourly_stats = Table(
+    'creator_hourly_stats', rollups_metadata,
+    Column('creator_id', String),
+    Column('hour', DateTime(timezone=True)),
+    *_delta_columns()
+)
\ No newline at end of file
@@ -1,8 +1,12 @@
+import argparse
 import asyncio
 import sys
 import os
 from dotenv import load_dotenv
-from database import drop_and_create_tables, load_json_to_db
+from database import (
+    SNAPSHOT_PARTITION, PARTITIONS, drop_and_create_tables, create_tables, create_indexes_and_rollups,
+    load_json_to_db, load_json_to_db_copy, load_json_to_db_incremental, load_json_to_db_parallel
+)
 import logging
 
 logging.basicConfig(
@@ -19,12 +23,43 @@ load_dotenv()
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Загрузка JSON-дампа в базу данных")
+    parser.add_argument("json_path", help="путь к JSON-файлу с видео")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--orm",
+        action="store_true",
+        help="загружать через ORM пачками (старый режим, для сравнения с COPY)"
+    )
+    mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help="не пересоздавать таблицы, а дозагрузить новые и измененные строки (upsert)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="число процессов и соединений для параллельной загрузки через COPY (по умолчанию 1)"
+    )
+    parser.add_argument(
+        "--batch-rows",
+        type=int,
+        default=50000,
+        help="размер пачки строк для COPY (по умолчанию 50000)"
+    )
+    parser.add_argument(
+        "--partition",
+        choices=PARTITIONS,
+        default=SNAPSHOT_PARTITION,
+        help=f"шаг секций video_snapshots по created_at (по умолчанию {SNAPSHOT_PARTITION}, переменная SNAPSHOT_PARTITION)"
+    )
+    return parser.parse_args()
+
 async def main():
-    if len(sys.argv) != 2:
-        logger.error("Использование: python setup_database.py <путь_к_json>")
-        sys.exit(1)
-    
-    json_path = sys.argv[1]
+    args = parse_args()
+    json_path = args.json_path
     
     if not os.path.exists(json_path):
         logger.error(f"Файл {json_path} не найден")
@@ -33,8 +68,21 @@ async def main():
     try:
         logger.info("Начинаем настройку базы данных...")
         
-        await drop_and_create_tables()        
-        await load_json_to_db(json_path)
+        if args.incremental:
+            await create_tables()
+            await load_json_to_db_incremental(json_path, batch_rows=args.batch_rows, partition=args.partition)
+        else:
+            engine = await drop_and_create_tables()
+            await engine.dispose()
+
+            if args.orm:
+                await load_json_to_db(json_path, partition=args.partition)
+            elif args.workers > 1:
+                await load_json_to_db_parallel(json_path, workers=args.workers, partition=args.partition)
+            else:
+                await load_json_to_db_copy(json_path, batch_rows=args.batch_rows, partition=args.partition)
+
+        await create_indexes_and_rollups()
         
         logger.info("База данных успешно настроена и загружена!")
         logger.info("Для запуска бота выполните: python bot.py")
@@ -0,0 +1,229 @@
+import os
+import uuid
+import random
+import asyncio
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("sqlalchemy")
+
+from ColumnarReplica import ColumnarReplica, NULL, TABLES, to_micros
+
+MOSCOW = ZoneInfo('Europe/Moscow')
+DAY = datetime(2025, 11, 1, tzinfo=MOSCOW)
+
+# creator_id, video_created_at, views_count; None — NULL
+VIDEOS = [
+    ('c1', DAY + timedelta(hours=1), 3),
+    ('c1', DAY + timedelta(hours=30), None),
+    ('c2', DAY - timedelta(hours=2), 10),
+    (None, DAY + timedelta(hours=5), 4),
+    ('c2', None, 1),
+    (None, None, None),
+]
+
+
+def _replica(rows=VIDEOS) -> ColumnarReplica:
+    replica = ColumnarReplica()
+    replica.timezone = MOSCOW
+    replica.version = 1
+    creators = {}
+    batch = {
+        'key': np.arange(len(rows), dtype=np.int64),
+        'creator_id': replica._encode_creators([row[0] for row in rows], creators),
+        'video_created_at': np.array([NULL if row[1] is None else to_micros(row[1]) for row in rows], dtype=np.int64),
+        'views_count': np.array([NULL if row[2] is None else row[2] for row in rows], dtype=np.int64),
+    }
+    for column in ('likes_count', 'comments_count', 'reports_count'):
+        batch[column] = np.zeros(len(rows), dtype=np.int64)
+    replica.creators = creators
+    replica._tables['videos'], replica._orders['videos'] = replica._merge('videos', None, None, batch)
+    replica._tables['video_snapshots'], replica._orders['video_snapshots'] = replica._merge(
+        'video_snapshots', None, None, replica._empty('video_snapshots')
+    )
+    return replica
+
+
+@pytest.mark.parametrize('query, expected', [
+    ("SELECT COUNT(*) FROM videos", 6),
+    ("SELECT COUNT(*) FROM videos WHERE views_count < 5", 3),
+    ("SELECT COUNT(*) FROM videos WHERE views_count <= 3", 2),
+    ("SELECT COUNT(*) FROM videos WHERE views_count >= 0", 4),
+    ("SELECT COUNT(DISTINCT creator_id) FROM videos", 2),
+    ("SELECT COUNT(DISTINCT creator_id) FROM videos WHERE views_count > 1", 2),
+    ("SELECT SUM(views_count) FROM videos", 18),
+    ("SELECT COALESCE(SUM(views_count), 0) FROM videos WHERE creator_id = 'c1'", 3),
+    ("SELECT SUM(views_count) FROM videos WHERE creator_id = 'нет такого'", 0),
+    ("SELECT COUNT(*) FROM videos WHERE video_created_at < '2025-11-02'", 3),
+    ("SELECT COUNT(*) FROM videos WHERE video_created_at <= '2025-11-01 01:00:00'", 2),
+    ("SELECT COUNT(*) FROM videos WHERE video_created_at >= '2025-11-01'", 3),
+    ("SELECT COUNT(*) FROM videos WHERE video_created_at >= '2025-10-31T21:00:00+00'", 3),
+    ("SELECT COUNT(*) FROM videos WHERE DATE(video_created_at) = '2025-11-01'", 2),
+])
+def test_answer_follows_sql_null_semantics(query, expected):
+    assert _replica().answer(query) == str(expected)
+
+
+def test_naive_time_without_session_zone_falls_back():
+    replica = _replica()
+    replica.timezone = None
+    assert replica.answer("SELECT COUNT(*) FROM videos WHERE video_created_at >= '2025-11-01'") is None
+    assert replica.answer("SELECT COUNT(*) FROM videos WHERE DATE(video_created_at) = '2025-11-01'") is None
+    assert replica.answer("SELECT COUNT(*) FROM videos WHERE video_created_at >= '2025-11-01T00:00:00+03'") == "3"
+
+
+def test_datetime_parameter_needs_zone():
+    replica = _replica()
+    query = "SELECT COUNT(*) FROM videos WHERE video_created_at >= :start"
+    assert replica.answer(query, {"start": datetime(2025, 11, 1)}) is None
+    assert replica.answer(query, {"start": DAY}) == "3"
+
+
+def test_merge_keeps_time_and_key_order():
+    replica = ColumnarReplica()
+    rng = random.Random(7)
+    for _ in range(50):
+        expected = {}
+        arrays = order = None
+        for _ in range(rng.randint(1, 5)):
+            keys = rng.sample(range(-100, 100), rng.randint(0, 40))
+            for key in keys:
+                expected[key] = (rng.choice([NULL, rng.randint(0, 20)]), rng.randint(0, 100))
+            batch = replica._empty('videos')
+            batch['key'] = np.array(keys, dtype=np.int64)
+            batch['video_created_at'] = np.array([expected[key][0] for key in keys], dtype=np.int64)
+            batch['views_count'] = np.array([expected[key][1] for key in keys], dtype=np.int64)
+            for column in TABLES['videos']['columns']:
+                if len(batch[column]) != len(keys):
+                    batch[column] = np.zeros(len(keys), dtype=batch[column].dtype)
+            arrays, order = replica._merge('videos', arrays, order, batch)
+
+            times = arrays['video_created_at']
+            keys_sorted = arrays['key'][order]
+            assert (times[1:] >= times[:-1]).all()
+            assert (keys_sorted[1:] > keys_sorted[:-1]).all()
+            assert {
+                int(key): (int(moment), int(views))
+                for key, moment, views in zip(arrays['key'], times, arrays['views_count'])
+            } == expected
+
+
+# Сверка с PostgreSQL: те же запросы через реплику и через БД. Таблицы
+# создаются во временной схеме, поэтому подойдет любая тестовая база
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+PARITY_QUERIES = [
+    ("SELECT COUNT(*) FROM videos", None),
+    ("SELECT COUNT(*) FROM videos WHERE views_count < 50", None),
+    ("SELECT COUNT(*) FROM videos WHERE likes_count <= 3 AND creator_id = 'c1'", None),
+    ("SELECT COUNT(DISTINCT creator_id) FROM videos", None),
+    ("SELECT COUNT(DISTINCT creator_id) FROM videos WHERE video_created_at >= '2025-11-01'", None),
+    ("SELECT SUM(views_count) FROM videos WHERE video_created_at < '2025-11-02 00:00:00'", None),
+    ("SELECT SUM(views_count) FROM videos WHERE creator_id = 'нет такого'", None),
+    ("SELECT COUNT(*) FROM videos WHERE DATE(video_created_at) = '2025-11-01'", None),
+    ("SELECT COALESCE(SUM(delta_views_count), 0) FROM video_snapshots WHERE DATE(created_at) = '2025-11-01'", None),
+    ("SELECT COUNT(*) FROM video_snapshots WHERE created_at <= :end", {"end": DAY + timedelta(hours=12)}),
+    ("SELECT COUNT(DISTINCT video_id) FROM video_snapshots WHERE delta_likes_count > 0", None),
+    ("SELECT SUM(delta_views_count) FROM video_snapshots WHERE delta_views_count < 0", None),
+]
+
+
+def _maybe(rng: random.Random, value):
+    return None if rng.random() < 0.15 else value
+
+
+async def _insert(session, rng: random.Random, count: int, updated_at: datetime) -> list:
+    from sqlalchemy import text
+
+    videos = []
+    for _ in range(count):
+        videos.append({
+            "id": uuid.uuid4(),
+            "creator_id": _maybe(rng, rng.choice(['c1', 'c2', 'c3'])),
+            "video_created_at": _maybe(rng, DAY + timedelta(minutes=rng.randint(-2000, 2000))),
+            "views_count": _maybe(rng, rng.randint(0, 100)),
+            "likes_count": _maybe(rng, rng.randint(0, 10)),
+            "updated_at": updated_at,
+        })
+    await session.execute(text(
+        "INSERT INTO videos (id, creator_id, video_created_at, views_count, likes_count, updated_at) "
+        "VALUES (:id, :creator_id, :video_created_at, :views_count, :likes_count, :updated_at)"
+    ), videos)
+
+    snapshots = [
+        {
+            "id": uuid.uuid4().hex,
+            "video_id": _maybe(rng, video["id"]),
+            "created_at": DAY + timedelta(minutes=rng.randint(-2000, 2000)),
+            "delta_views_count": _maybe(rng, rng.randint(-5, 50)),
+            "delta_likes_count": _maybe(rng, rng.randint(0, 3)),
+            "updated_at": updated_at,
+        }
+        for video in videos for _ in range(3)
+    ]
+    await session.execute(text(
+        "INSERT INTO video_snapshots (id, video_id, created_at, delta_views_count, delta_likes_count, updated_at) "
+        "VALUES (:id, :video_id, :created_at, :delta_views_count, :delta_likes_count, :updated_at)"
+    ), snapshots)
+    return videos
+
+
+async def _compare(session, replica: ColumnarReplica):
+    from sqlalchemy import text
+
+    for query, params in PARITY_QUERIES:
+        value = (await session.execute(text(query), params or {})).scalar()
+        expected = "0" if value is None else str(value)
+        assert replica.answer(query, params) == expected, query
+
+
+async def _parity():
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+    from database.models import Base
+
+    schema = f"replica_parity_{uuid.uuid4().hex[:8]}"
+    engine = create_async_engine(
+        TEST_DATABASE_URL,
+        connect_args={"server_settings": {"search_path": schema, "TimeZone": "Europe/Moscow"}},
+    )
+    sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"CREATE SCHEMA {schema}"))
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(text("CREATE TABLE video_snapshots_default PARTITION OF video_snapshots DEFAULT"))
+
+        rng = random.Random(16)
+        started = datetime.now(timezone.utc)
+        replica = ColumnarReplica(batch_rows=50)
+        async with sessions() as session:
+            videos = await _insert(session, rng, 200, started)
+            await session.commit()
+            await replica.refresh(session, 1)
+            assert replica.rebuilds == 1
+            await _compare(session, replica)
+
+            # Обновление: часть счетчиков становится NULL, появляются новые строки
+            changed = [video["id"] for video in videos[:40]]
+            await session.execute(text(
+                "UPDATE videos SET views_count = NULL, creator_id = 'c4', updated_at = :updated_at WHERE id = ANY(:ids)"
+            ), {"ids": changed, "updated_at": started + timedelta(seconds=1)})
+            await _insert(session, rng, 50, started + timedelta(seconds=1))
+            await session.commit()
+            await replica.refresh(session, 2)
+            assert replica.refreshes == 1
+            await _compare(session, replica)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        await engine.dispose()
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="нужна PostgreSQL в TEST_DATABASE_URL")
+def test_parity_with_postgres():
+    pytest.importorskip("asyncpg")
+    asyncio.run(_parity())
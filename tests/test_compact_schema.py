@@ -0,0 +1,16 @@
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("sqlalchemy")
+
+from SqlQueryGenerator import compact_schema
+from database.models import Base, SERVICE_TABLES, rollups_metadata
+
+
+def test_compact_schema_uses_postgresql_types():
+    lines = compact_schema(Base.metadata, rollups_metadata, exclude=SERVICE_TABLES).splitlines()
+    videos = next(line for line in lines if line.startswith('videos('))
+    assert 'video_created_at timestamp with time zone' in videos
+    assert 'id uuid' in videos
+    assert 'datetime' not in videos
+    assert not any(line.startswith(tuple(SERVICE_TABLES)) for line in lines)
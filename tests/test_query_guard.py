@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from QueryGuard import QueryGuard, is_statement_timeout
+
+
+class QueryCanceled(Exception):
+    sqlstate = '57014'
+
+
+class DBAPIError(Exception):
+    def __init__(self, orig):
+        super().__init__(str(orig))
+        self.orig = orig
+
+
+def test_statement_timeout_raw_and_wrapped():
+    assert is_statement_timeout(QueryCanceled())
+    assert is_statement_timeout(DBAPIError(QueryCanceled()))
+    assert not is_statement_timeout(DBAPIError(ValueError()))
+    assert not is_statement_timeout(RuntimeError())
+
+
+class FakeResult:
+    def __init__(self, cost):
+        self.cost = cost
+
+    def scalar(self):
+        return [{"Plan": {"Total Cost": self.cost}}]
+
+
+class FakeSession:
+    # Стоимость растет с шириной диапазона: '2025-11-01' дешевле '2020-01-01'
+    def __init__(self):
+        self.explained = []
+
+    async def execute(self, statement, params=None):
+        query = str(statement)
+        self.explained.append(query)
+        return FakeResult(1e3 if "2025-11-01" in query else 1e9)
+
+
+def test_different_literals_are_costed_separately():
+    guard = QueryGuard(max_cost=1e6)
+    session = FakeSession()
+    cheap = "SELECT COUNT(*) FROM video_snapshots WHERE created_at >= '2025-11-01'"
+    wide = "SELECT COUNT(*) FROM video_snapshots WHERE created_at >= '2020-01-01'"
+
+    async def run():
+        return [
+            await guard.admit(session, cheap),
+            await guard.admit(session, wide),
+            await guard.admit(session, cheap),
+        ]
+
+    assert asyncio.run(run()) == [True, False, True]
+    assert len(session.explained) == 2
+    assert guard.stats()["cached_plans"] == 2
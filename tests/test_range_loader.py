@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiofiles")
+pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+pytest.importorskip("sqlalchemy")
+
+# database.py импортирует models как модуль верхнего уровня и без
+# DATABASE_URL завершает процесс; подключение в тестах не открывается.
+# Пакет database импортируется раньше, чем каталог попадает в sys.path,
+# иначе import database найдет сам database.py
+import database.models  # noqa: F401
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database'))
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://test@localhost/test")
+
+from database.database import iter_json_videos, iter_range_videos, videos_array_offset
+
+
+def _videos(count: int = 12) -> list:
+    videos = []
+    for i in range(count):
+        videos.append({
+            "id": f"v{i}",
+            "creator_id": f"Креатор ё{i % 3}",
+            "video_created_at": f"2025-11-{i % 28 + 1:02d}T10:00:00+00:00",
+            "views_count": i * 7,
+            # Строка похожа на начало видео: поиск первого видео диапазона
+            # не должен принимать ее за объект
+            "title": '{"creator_id": "x", "video_created_at": "y"} {' if i % 2 else "Видео — «тест»",
+            "snapshots": [
+                {"id": f"s{i}_{j}", "video_id": f"v{i}", "delta_views_count": j, "created_at": "2025-11-01T00:00:00+00:00"}
+                for j in range(i % 4)
+            ],
+        })
+    return videos
+
+
+def _write(path, videos, indent):
+    data = {"meta": {"note": "] { \"videos\": ["}, "videos": videos, "tail": 1}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+
+
+async def _collect(path) -> list:
+    return [video async for video in iter_json_videos(str(path), chunk_size=64)]
+
+
+def _sharded(path, shard: int, chunk_size: int) -> list:
+    # Диапазоны режутся так же, как в _load_range
+    size = os.path.getsize(path)
+    first = videos_array_offset(str(path))
+    videos = []
+    for start in range(first, size, shard):
+        videos.extend(iter_range_videos(str(path), start, min(start + shard, size), start == first, chunk_size=chunk_size))
+    return videos
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_shards_match_full_parse(tmp_path, indent):
+    path = tmp_path / 'videos.json'
+    _write(path, _videos(), indent)
+    expected = asyncio.run(_collect(path))
+    assert expected == _videos()
+
+    size = os.path.getsize(path)
+    for shard in list(range(1, 200, 7)) + [size // 3, size // 2, size]:
+        for chunk_size in (16, 1 << 22):
+            assert _sharded(path, shard, chunk_size) == expected, (shard, chunk_size)
+
+
+def test_every_byte_offset_is_a_boundary(tmp_path):
+    # Граница после каждого байта, в том числе внутри многобайтового символа
+    path = tmp_path / 'videos.json'
+    _write(path, _videos(5), 1)
+    expected = asyncio.run(_collect(path))
+    size = os.path.getsize(path)
+    first = videos_array_offset(str(path))
+    for cut in range(first + 1, size):
+        videos = list(iter_range_videos(str(path), first, cut, True, chunk_size=32))
+        videos += list(iter_range_videos(str(path), cut, size, False, chunk_size=32))
+        assert videos == expected, cut
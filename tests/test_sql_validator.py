@@ -0,0 +1,130 @@
+import pytest
+
+from SqlValidator import SqlValidator, tokenize
+
+TABLES = {
+    'videos': {
+        'id', 'creator_id', 'video_created_at', 'views_count', 'likes_count',
+        'comments_count', 'reports_count', 'created_at', 'updated_at',
+    },
+    'video_snapshots': {
+        'id', 'video_id', 'views_count', 'likes_count', 'comments_count', 'reports_count',
+        'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+        'created_at', 'updated_at',
+    },
+    'creator_daily_stats': {
+        'creator_id', 'day', 'delta_views_count', 'delta_likes_count',
+        'delta_comments_count', 'delta_reports_count', 'snapshots_count',
+    },
+}
+
+
+@pytest.fixture
+def validator():
+    return SqlValidator(TABLES)
+
+
+def test_tokenize_roundtrip():
+    query = "SELECT COUNT(*) -- всего\nFROM videos /* все */ WHERE creator_id = 'it''s';"
+    tokens = tokenize(query)
+    assert ''.join(value for _, value in tokens) == query
+    assert ('string', "'it''s'") in tokens
+    assert ('line_comment', '-- всего') in tokens
+    assert ('block_comment', '/* все */') in tokens
+
+
+def test_tokenize_kinds():
+    kinds = [kind for kind, _ in tokenize("SELECT 1.5e3, E'a\\'b', \"Videos\"::text") if kind != 'ws']
+    assert kinds == ['ident', 'number', 'op', 'estring', 'op', 'qident', 'op', 'ident']
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT 1 $$ drop $$",
+    "SELECT 'незакрытая строка",
+    "SELECT @x",
+    "SELECT `id` FROM videos",
+])
+def test_tokenize_rejects_unknown_characters(query):
+    assert tokenize(query) is None
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT COUNT(*) FROM videos",
+    "select count(*) from videos;",
+    "SELECT COUNT(*) FROM videos WHERE DATE(video_created_at) = '2025-11-28'",
+    "SELECT SUM(s.delta_views_count) FROM video_snapshots s JOIN videos v ON v.id = s.video_id "
+    "WHERE v.creator_id = 'abc' AND s.created_at >= '2025-11-28 10:00:00+00' AND s.created_at < '2025-11-28 15:00:00+00'",
+    "SELECT COUNT(*) FROM videos WHERE video_created_at >= CURRENT_DATE - INTERVAL '7 days'",
+    "SELECT COUNT(*) FROM videos WHERE video_created_at >= now() - interval '1 day'",
+    "SELECT COUNT(*) FROM videos WHERE video_created_at::date = current_date",
+    "SELECT string_agg(DISTINCT creator_id, ',') FROM videos",
+    "SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY views_count) FROM videos",
+    "SELECT COALESCE(SUM(delta_views_count), 0) FROM creator_daily_stats WHERE day = '2025-11-28'",
+    "WITH top AS (SELECT creator_id, SUM(views_count) AS total FROM videos GROUP BY creator_id) "
+    "SELECT MAX(total) FROM top",
+    "SELECT COUNT(*) FROM (SELECT video_id FROM video_snapshots GROUP BY video_id) t",
+    "SELECT EXTRACT(HOUR FROM created_at) FROM video_snapshots LIMIT 1",
+    "WITH top AS (SELECT creator_id, COUNT(*) AS n FROM videos GROUP BY creator_id) "
+    "SELECT COUNT(*) FROM top t JOIN videos v ON v.creator_id = t.creator_id WHERE n > 1",
+    "SELECT COUNT(*) FROM videos v, video_snapshots s WHERE s.video_id = v.id",
+    "-- комментарий\nSELECT COUNT(*) FROM videos /* ; */",
+])
+def test_accepts(validator, query):
+    assert validator.check(query) is None
+
+
+@pytest.mark.parametrize('query, reason', [
+    ("", "пустой запрос"),
+    ("DELETE FROM videos", "запрос должен начинаться"),
+    ("SELECT 1; DROP TABLE videos", "только один оператор"),
+    ("SELECT 1; SELECT 2", "только один оператор"),
+    ("SELECT * INTO backup FROM videos", "запрещенное ключевое слово: into"),
+    ("SELECT COUNT(*) FROM videos UNION SELECT COUNT(*) FROM video_snapshots", "запрещенное ключевое слово: union"),
+    ("SELECT id FROM videos EXCEPT SELECT video_id FROM video_snapshots", "запрещенное ключевое слово: except"),
+    ("SELECT COUNT(*) FROM video_snapshots a CROSS JOIN video_snapshots b", "запрещенное ключевое слово: cross"),
+    ("SELECT pg_sleep(10)", "функция не разрешена: pg_sleep"),
+    ("SELECT current_user", "запрещенное ключевое слово"),
+    ("SELECT COUNT(*) FROM pg_user", "таблица не разрешена: pg_user"),
+    ("SELECT COUNT(*) FROM information_schema.tables", "таблица не разрешена: information_schema"),
+    # Псевдоним в списке SELECT не разрешает одноименную таблицу в подзапросе
+    ("select (select x from pg_roles as x limit 1)::text as pg_roles", "таблица не разрешена: pg_roles"),
+    ("select (select count(*) from pg_stat_activity) as pg_stat_activity", "таблица не разрешена: pg_stat_activity"),
+    (
+        "select (select string_agg(x::text, ',') from pg_settings as x) as pg_settings",
+        "таблица не разрешена: pg_settings",
+    ),
+    (
+        "select (select count(*) from ingest_watermarks) as ingest_watermarks",
+        "таблица не разрешена: ingest_watermarks",
+    ),
+    ("SELECT COUNT(*) FROM videos v, pg_roles r", "таблица не разрешена: pg_roles"),
+    ("SELECT COUNT(*) FROM videos v JOIN pg_authid a ON true", "таблица не разрешена: pg_authid"),
+    # Имя CTE видно только после его тела
+    (
+        "WITH pg_authid AS (SELECT * FROM pg_authid) SELECT COUNT(*) FROM pg_authid",
+        "таблица не разрешена: pg_authid",
+    ),
+    ("SELECT 1 AS pg_roles, (TABLE pg_roles)", "запрещенное ключевое слово: table"),
+    ("SELECT COUNT(*) FROM videos v WHERE v.password = 'x'", "неизвестная колонка: password"),
+    ("SELECT id::regclass FROM videos", "недопустимый тип: regclass"),
+    ("SELECT (COUNT(*) FROM videos", "несбалансированные скобки"),
+    ("SELECT COUNT(*)) FROM videos", "несбалансированные скобки"),
+    ("SELECT 1 $$", "недопустимый символ"),
+])
+def test_rejects(validator, query, reason):
+    result = validator.check(query)
+    assert result is not None and reason in result
+
+
+def test_quoted_identifiers_are_checked(validator):
+    assert validator.check('SELECT COUNT(*) FROM "videos"') is None
+    assert validator.check('SELECT COUNT(*) FROM "Pg_Authid"') is not None
+
+
+def test_from_metadata_uses_table_columns():
+    sqlalchemy = pytest.importorskip('sqlalchemy')
+    metadata = sqlalchemy.MetaData()
+    sqlalchemy.Table('videos', metadata, sqlalchemy.Column('id', sqlalchemy.Integer))
+    validator = SqlValidator.from_metadata(metadata)
+    assert validator.is_safe("SELECT COUNT(id) FROM videos")
+    assert not validator.is_safe("SELECT COUNT(*) FROM video_snapshots")
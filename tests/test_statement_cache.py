@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from StatementCache import combine_queries, convert_literal, parameterize, session_zone
+
+
+def test_combine_queries_survives_trailing_comment():
+    query, params = combine_queries([
+        ("SELECT COUNT(*) FROM videos -- всего", None),
+        ("SELECT SUM(views_count) /* по креатору */ FROM videos WHERE creator_id = 'a';", None),
+        ("SELECT COUNT(*) FROM videos WHERE creator_id = :creator_id", {"creator_id": "b"}),
+    ])
+    assert '--' not in query and '/*' not in query
+    assert query.count('(\n') == 3 and query.count('\n)') == 3
+    assert ';' not in query
+    assert ':q2_creator_id' in query
+    assert params == {"q2_creator_id": "b"}
+
+
+def test_parameterize_keeps_typed_literals_and_order_by():
+    shape, literals = parameterize(
+        "SELECT creator_id FROM videos WHERE views_count > 100 AND video_created_at >= DATE '2025-11-01' "
+        "ORDER BY 1 LIMIT 5"
+    )
+    assert shape == (
+        "SELECT creator_id FROM videos WHERE views_count > $1 AND video_created_at >= DATE '2025-11-01' "
+        "ORDER BY 1 LIMIT $2"
+    )
+    assert literals == [('number', '100'), ('number', '5')]
+
+
+def test_naive_timestamptz_literal_uses_session_zone():
+    moscow = session_zone('Europe/Moscow')
+    assert convert_literal('timestamptz', 'string', '2025-11-01', moscow) == datetime(2025, 11, 1, tzinfo=ZoneInfo('Europe/Moscow'))
+    assert convert_literal('timestamptz', 'string', '2025-11-01 10:00:00+00', moscow) == datetime(
+        2025, 11, 1, 10, tzinfo=timezone.utc
+    )
+
+
+def test_naive_timestamptz_literal_without_zone_falls_back():
+    with pytest.raises(ValueError):
+        convert_literal('timestamptz', 'string', '2025-11-01')
+    with pytest.raises(ValueError):
+        convert_literal('timestamptz', 'string', '2025-11-01', session_zone('<+03>-03'))